@@ -1,11 +1,12 @@
 import logging
 import requests
 import json
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from decimal import Decimal
 from django import forms
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from pretix.base.payment import BasePaymentProvider, PaymentException
@@ -16,11 +17,23 @@ from pretix.multidomain.urlreverse import build_absolute_uri, eventreverse
 from django.template.loader import get_template
 from datetime import datetime
 import urllib.parse
-from .utils import get_descriptive_status, format_date, extract_checkout_id_from_url, get_payment_details_from_recurrente
+import hashlib
+from django.core.cache import cache
+from .utils import get_descriptive_status, format_date, extract_checkout_id_from_url, get_payment_details_from_recurrente, json_loads, http_session, safe_json_parse
 import re
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
 
 logger = logging.getLogger('pretix.plugins.recurrente')
 
+# Tabla para convertir saltos de línea en <br> en el texto simple de los correos
+_NEWLINE_TO_BR = str.maketrans({'\n': '<br>'})
+
+# Campos de la respuesta de checkout que ya se registran individualmente
+_CHECKOUT_RESPONSE_KEYS = frozenset({'id', 'checkout_url', 'status', 'created_at', 'expires_at'})
+
 class Recurrente(BasePaymentProvider):
     """
     Proveedor de pagos para Recurrente.
@@ -48,9 +61,34 @@ class Recurrente(BasePaymentProvider):
     # Permitir cancelar pagos pendientes
     abort_pending_allowed = True
 
+    # Plantillas ya compiladas, compartidas entre instancias del proveedor
+    _template_cache = {}
+
+    # Campos de info_data que se copian con el nombre que espera payment_info.html
+    _PAYMENT_INFO_ALIASES = (
+        ('external_payment_id', 'payment_id'),
+        ('external_checkout_id', 'checkout_id'),
+        ('receipt_number', 'numero_recibo'),
+        ('authorization_code', 'codigo_autorizacion'),
+        ('created_at_recurrente', 'created'),
+        ('created_at_recurrente', 'fecha_pago'),
+        ('payment_method_type', 'payment_method'),
+        ('payment_method_type', 'metodo_pago'),
+    )
+
     def __init__(self, event: Event):
         super().__init__(event)
         self.settings = SettingsSandbox('payment', 'recurrente', event)
+        # Configuración de API ya leída, por pk de evento (ver _get_api_settings)
+        self._api_settings_cache = {}
+
+    @classmethod
+    def _get_template(cls, name):
+        """Obtiene una plantilla compilada, cargándola solo la primera vez"""
+        template = cls._template_cache.get(name)
+        if template is None:
+            template = cls._template_cache[name] = get_template(name)
+        return template
 
     @property
     def test_mode_message(self):
@@ -365,6 +403,12 @@ class Recurrente(BasePaymentProvider):
 
             # Verificar si es un pago recurrente
             is_recurring = self.settings.get('enable_recurring', as_type=bool) and request.session.get('recurrente_recurring')
+            recurring_config = None
+            if is_recurring:
+                recurring_config = {
+                    'frequency': str(self.settings.get('recurring_frequency', 'monthly')),
+                    'end_behavior': str(self.settings.get('recurring_end_behavior', 'cancel')),
+                }
 
             # Headers para la API de Recurrente
             headers = {
@@ -422,7 +466,6 @@ class Recurrente(BasePaymentProvider):
                         logger.info(f"Respuesta de búsqueda de usuario por email: status={search_response.status_code}")
 
                         # Procesar respuesta de búsqueda
-                        from .utils import safe_json_parse
                         search_data = safe_json_parse(search_response)
                         existing_user_id = None
 
@@ -605,10 +648,7 @@ class Recurrente(BasePaymentProvider):
 
             # Agregar configuración para pago recurrente si está habilitado
             if is_recurring:
-                payload['recurring'] = {
-                    'frequency': str(self.settings.get('recurring_frequency', 'monthly')),
-                    'end_behavior': str(self.settings.get('recurring_end_behavior', 'cancel')),
-                }
+                payload['recurring'] = dict(recurring_config)
 
             # Guardar información del pedido en la sesión para procesarla después
             request.session['payment_recurrente_order'] = order.code
@@ -616,10 +656,7 @@ class Recurrente(BasePaymentProvider):
             request.session['payment_recurrente_payment_id'] = payment.pk
             if is_recurring:
                 request.session['payment_recurrente_is_recurring'] = True
-                request.session['payment_recurrente_recurring_config'] = {
-                    'frequency': str(self.settings.get('recurring_frequency', 'monthly')),
-                    'end_behavior': str(self.settings.get('recurring_end_behavior', 'cancel')),
-                }
+                request.session['payment_recurrente_recurring_config'] = dict(recurring_config)
 
             # ----- 4. REALIZAR LA SOLICITUD A LA API Y PROCESAR RESPUESTA -----
 
@@ -631,106 +668,99 @@ class Recurrente(BasePaymentProvider):
             # Log del payload completo antes de enviarlo a la API
             logger.info(f"Payload completo a Recurrente: {json.dumps(payload, indent=2, ensure_ascii=False)}")
 
-            try:
-                # Realizar solicitud a la API
-                response = requests.post(
-                    api_endpoint,
-                    json=payload,
-                    headers=headers,
-                    timeout=10,
-                    verify=not ignore_ssl
-                )
-
-                # Información para depuración
-                debug_info = {
-                    'status_code': response.status_code,
-                    'content_type': response.headers.get('content-type'),
-                    'content_length': len(response.text) if response.text else 0,
-                }
+            # Realizar solicitud a la API
+            response = requests.post(
+                api_endpoint,
+                json=payload,
+                headers=headers,
+                timeout=10,
+                verify=not ignore_ssl
+            )
 
-                # Validaciones de respuesta
-                if not response.text or not response.text.strip():
-                    raise PaymentException(_('Error: La API devolvió una respuesta vacía'))
+            # Leer el cuerpo una sola vez como bytes para no decodificarlo varias veces
+            body = response.content or b''
 
-                if response.headers.get('content-type', '').startswith('text/html') or response.text.strip().startswith('<!DOCTYPE'):
-                    raise PaymentException(_('Error: La URL de API parece ser un sitio web, no una API'))
+            # Información para depuración
+            debug_info = {
+                'status_code': response.status_code,
+                'content_type': response.headers.get('content-type'),
+                'content_length': len(body),
+            }
 
-                if response.status_code >= 400:
-                    error_msg = response.text if response.text else f"Error HTTP {response.status_code}"
-                    raise PaymentException(_('Error de comunicación con Recurrente: {}').format(error_msg))
+            # Validaciones de respuesta
+            if not body.strip():
+                raise PaymentException(_('Error: La API devolvió una respuesta vacía'))
 
-                # Procesar respuesta como JSON
-                from .utils import safe_json_parse
-                try:
-                    response_data = safe_json_parse(response)
-                    if not response_data:
-                        raise PaymentException(_('Error: La respuesta no contiene datos válidos'))
-                except Exception as e:
-                    logger.exception(f"Error al procesar respuesta JSON: {str(e)}")
-                    raise PaymentException(_('Error al procesar la respuesta: {}').format(str(e)))
-
-                # Log detallado de la respuesta
-                logger.info(f"Respuesta completa de Recurrente:")
-                logger.info(f"ID: {response_data.get('id', 'No disponible')}")
-                logger.info(f"checkout_url: {response_data.get('checkout_url', 'No disponible')}")
-                logger.info(f"status: {response_data.get('status', 'No disponible')}")
-                logger.info(f"created_at: {response_data.get('created_at', 'No disponible')}")
-                logger.info(f"expires_at: {response_data.get('expires_at', 'No disponible')}")
-                logger.info(f"Otros campos: {[k for k in response_data.keys() if k not in ['id', 'checkout_url', 'status', 'created_at', 'expires_at']]}")
-
-                # Verificar campos requeridos
-                if 'id' not in response_data or 'checkout_url' not in response_data:
-                    raise PaymentException(_('Error: La respuesta no contiene la información necesaria'))
-
-                # Guardar información del pago
-                payment.info_data = {
-                    'checkout_id': response_data.get('id'),
-                    'checkout_url': response_data.get('checkout_url'),
-                    'status': response_data.get('status'),
-                    'created_at': response_data.get('created_at'),
-                    'expires_at': response_data.get('expires_at'),
-                    'is_recurring': is_recurring,
-                    'api_endpoint': api_endpoint
-                }
+            if response.headers.get('content-type', '').startswith('text/html') or body.lstrip().startswith(b'<!DOCTYPE'):
+                raise PaymentException(_('Error: La URL de API parece ser un sitio web, no una API'))
 
-                # Información adicional para pagos recurrentes
-                if is_recurring:
-                    payment.info_data['recurring_config'] = {
-                        'frequency': str(self.settings.get('recurring_frequency', 'monthly')),
-                        'end_behavior': str(self.settings.get('recurring_end_behavior', 'cancel')),
-                    }
+            if response.status_code >= 400:
+                error_msg = response.text or f"Error HTTP {response.status_code}"
+                raise PaymentException(_('Error de comunicación con Recurrente: {}').format(error_msg))
 
-                payment.save(update_fields=['info'])
+            # Procesar respuesta como JSON
+            try:
+                response_data = safe_json_parse(response)
+                if not response_data:
+                    raise PaymentException(_('Error: La respuesta no contiene datos válidos'))
+            except Exception as e:
+                logger.exception(f"Error al procesar respuesta JSON: {str(e)}")
+                raise PaymentException(_('Error al procesar la respuesta: {}').format(str(e)))
+
+            # Log detallado de la respuesta
+            logger.info(f"Respuesta completa de Recurrente:")
+            logger.info(f"ID: {response_data.get('id', 'No disponible')}")
+            logger.info(f"checkout_url: {response_data.get('checkout_url', 'No disponible')}")
+            logger.info(f"status: {response_data.get('status', 'No disponible')}")
+            logger.info(f"created_at: {response_data.get('created_at', 'No disponible')}")
+            logger.info(f"expires_at: {response_data.get('expires_at', 'No disponible')}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Otros campos: %s", sorted(response_data.keys() - _CHECKOUT_RESPONSE_KEYS))
+
+            # Verificar campos requeridos
+            if 'id' not in response_data or 'checkout_url' not in response_data:
+                raise PaymentException(_('Error: La respuesta no contiene la información necesaria'))
+
+            # Guardar información del pago
+            info = {
+                'checkout_id': response_data.get('id'),
+                'checkout_url': response_data.get('checkout_url'),
+                'status': response_data.get('status'),
+                'created_at': response_data.get('created_at'),
+                'expires_at': response_data.get('expires_at'),
+                'is_recurring': is_recurring,
+                'api_endpoint': api_endpoint
+            }
 
-                # Redirigir al usuario a la página de pago
-                checkout_url = response_data.get('checkout_url')
-                logger.info(f"Redirigiendo a checkout: {checkout_url}")
+            # Información adicional para pagos recurrentes
+            if is_recurring:
+                info['recurring_config'] = dict(recurring_config)
 
-                # Analizar parámetros de la URL para depuración
-                try:
-                    if checkout_url and '?' in checkout_url:
-                        url_parts = checkout_url.split('?')
-                        if len(url_parts) > 1:
-                            logger.info(f"Parámetros en URL: {url_parts[1]}")
-                except Exception:
-                    pass
+            payment.info_data = info
+            payment.save(update_fields=['info'])
 
-                return checkout_url
+            # Redirigir al usuario a la página de pago
+            checkout_url = response_data.get('checkout_url')
+            logger.info(f"Redirigiendo a checkout: {checkout_url}")
 
-            except requests.RequestException as e:
-                logger.exception(f'Error de conexión con Recurrente: {str(e)}')
-                raise PaymentException(_('Error de conexión: {}').format(str(e)))
-            except PaymentException:
-                raise
-            except Exception as e:
-                logger.exception(f'Error al procesar el pago: {str(e)}')
-                raise PaymentException(_('Error al procesar el pago: {}').format(str(e)))
+            # Analizar parámetros de la URL para depuración
+            try:
+                if checkout_url and '?' in checkout_url:
+                    url_parts = checkout_url.split('?')
+                    if len(url_parts) > 1:
+                        logger.info(f"Parámetros en URL: {url_parts[1]}")
+            except Exception:
+                pass
+
+            return checkout_url
 
         except requests.RequestException as e:
-            logger.exception('Error de conexión con Recurrente')
+            logger.exception(f'Error de conexión con Recurrente: {str(e)}')
             raise PaymentException(_('Error de conexión: {}').format(str(e)))
+        except PaymentException:
+            raise
         except Exception as e:
-            logger.exception('Error al procesar el pago')
+            logger.exception(f'Error al procesar el pago: {str(e)}')
             raise PaymentException(_('Error al procesar el pago: {}').format(str(e)))
 
     def payment_pending_render(self, request, payment):
@@ -743,14 +773,16 @@ class Recurrente(BasePaymentProvider):
         - Enlace para actualizar el estado manualmente
         - Instrucciones sobre qué hacer si el pago ya se realizó
         """
-        from .utils import get_descriptive_status, format_date
         
         # Preparar mensaje base
         template = get_template('pretix_recurrente/pending_payment.html')
         
+        # info_data decodifica el JSON en cada acceso: leerlo una sola vez
+        info_data = payment.info_data
+        
         # Botón para continuar el pago pendiente
-        has_checkout_url = 'checkout_url' in payment.info_data and payment.info_data['checkout_url']
-        checkout_url = payment.info_data.get('checkout_url', '#')
+        has_checkout_url = 'checkout_url' in info_data and info_data['checkout_url']
+        checkout_url = info_data.get('checkout_url', '#')
         
         # Botón para actualizar el estado manualmente
         update_url = eventreverse(request.event, 'plugins:pretix_recurrente:update_status', kwargs={}) + \
@@ -763,17 +795,17 @@ class Recurrente(BasePaymentProvider):
         })
         
         # Verificar si el pago tiene información de estado
-        status = payment.info_data.get('status')
+        status = info_data.get('status')
         status_text = get_descriptive_status(status)
         
         # Verificar cuándo fue creado el pago
-        created_at = format_date(payment.info_data.get('created_at'))
+        created_at = format_date(info_data.get('created_at'))
         
         # Verificar si el pago tiene fecha de expiración
-        expires_at = format_date(payment.info_data.get('expires_at'))
+        expires_at = format_date(info_data.get('expires_at'))
         
         # Obtener información sobre la última actualización
-        last_updated = format_date(payment.info_data.get('last_updated'))
+        last_updated = format_date(info_data.get('last_updated'))
         
         # Determinar si viene de redirección de Recurrente
         is_from_recurrente_redirect = False
@@ -816,7 +848,6 @@ class Recurrente(BasePaymentProvider):
         """
         Renderizar información detallada del pago para el panel de control.
         """
-        from .utils import get_descriptive_status, format_date, extract_checkout_id_from_url, get_payment_details_from_recurrente
         
         template = get_template('pretix_recurrente/control.html')
         
@@ -876,7 +907,7 @@ class Recurrente(BasePaymentProvider):
                             )
                             
                             if payment_data:
-                                logger.info(f"Datos recuperados de la API para pago {payment.pk}: {payment_data}")
+                                logger.debug("Datos recuperados de la API para pago %s: %s", payment.pk, payment_data)
                                 # Actualizar info_data con los datos de la API
                                 if 'receipt_number' in payment_data:
                                     info_data['receipt_number'] = payment_data['receipt_number']
@@ -1025,20 +1056,22 @@ class Recurrente(BasePaymentProvider):
             created_at = ""
             if info_data.get('created_at'):
                 try:
-                    from .utils import format_date
                     created_at = format_date(info_data.get('created_at'))
                 except:
                     created_at = info_data.get('created_at')
             
             # Siempre mostrar al menos el recibo para pagos confirmados
-            return mark_safe(f"""
-            <div class="payment-recurrente-info" style="margin-top:5px; line-height:1.5;">
-                <div><span style="font-weight:bold;color:#337ab7;">Recibo:</span> {receipt_number}</div>
-                {f'<div><span style="font-weight:bold;color:#337ab7;">Autorización:</span> {auth_code}</div>' if auth_code else ''}
-                <div><span style="font-weight:bold;color:#337ab7;">Método:</span> {card_info}</div>
-                {f'<div><span style="font-weight:bold;color:#337ab7;">Fecha:</span> {created_at}</div>' if created_at else ''}
-            </div>
-            """)
+            parts = [
+                '<div class="payment-recurrente-info" style="margin-top:5px; line-height:1.5;">',
+                f'<div><span style="font-weight:bold;color:#337ab7;">Recibo:</span> {receipt_number}</div>',
+            ]
+            if auth_code:
+                parts.append(f'<div><span style="font-weight:bold;color:#337ab7;">Autorización:</span> {auth_code}</div>')
+            parts.append(f'<div><span style="font-weight:bold;color:#337ab7;">Método:</span> {card_info}</div>')
+            if created_at:
+                parts.append(f'<div><span style="font-weight:bold;color:#337ab7;">Fecha:</span> {created_at}</div>')
+            parts.append('</div>')
+            return mark_safe(''.join(parts))
         
         # Para pagos pendientes
         elif payment.state == OrderPayment.PAYMENT_STATE_PENDING:
@@ -1070,8 +1103,10 @@ class Recurrente(BasePaymentProvider):
         """Ejecutar un reembolso"""
         payment = refund.payment
         try:
+            info_data = payment.info_data
+            
             # Verificar que tenemos la información necesaria
-            if 'payment_id' not in payment.info_data:
+            if 'payment_id' not in info_data:
                 raise PaymentException(_('No se encontró el ID de pago para realizar el reembolso'))
 
             # Obtener credenciales
@@ -1082,7 +1117,7 @@ class Recurrente(BasePaymentProvider):
                 raise PaymentException(_('El plugin de Recurrente no está configurado correctamente. Contacta al organizador del evento.'))
 
             # Preparar datos para la API de Recurrente
-            payment_id = payment.info_data['payment_id']
+            payment_id = info_data['payment_id']
             payload = {
                 'amount': int(refund.amount * 100),  # Convertir a centavos
                 'reason': _('Reembolso del pedido {}').format(payment.order.code),
@@ -1104,11 +1139,11 @@ class Recurrente(BasePaymentProvider):
             )
 
             if response.status_code >= 400:
-                logger.error(f"Error en la respuesta de Recurrente para reembolso: {response.status_code} - {response.text}")
-                raise PaymentException(_('Error al comunicarse con Recurrente para el reembolso: {}').format(response.text))
+                error_text = response.text
+                logger.error(f"Error en la respuesta de Recurrente para reembolso: {response.status_code} - {error_text}")
+                raise PaymentException(_('Error al comunicarse con Recurrente para el reembolso: {}').format(error_text))
 
             # Verificar si hay contenido antes de intentar parsear como JSON
-            from .utils import safe_json_parse
             response_data = safe_json_parse(response)
 
             # Guardar información del reembolso
@@ -1124,12 +1159,12 @@ class Recurrente(BasePaymentProvider):
                 refund.done()
             else:
                 # Los reembolsos pueden estar en estado "processing" por un tiempo
-                logger.info(f"Reembolso en proceso: {response_data}")
+                logger.info("Reembolso en proceso: %s", response_data)
                 refund.state = OrderRefund.REFUND_STATE_TRANSIT
                 refund.save(update_fields=['state'])
 
             # Si el reembolso es para un pago recurrente, cancelar la suscripción si es necesario
-            if payment.info_data.get('is_recurring', False) and refund.full_refund:
+            if info_data.get('is_recurring', False) and refund.full_refund:
                 # Aquí iría el código para cancelar la suscripción recurrente en Recurrente
                 # Por ejemplo:
                 # cancel_subscription(payment.info_data.get('subscription_id'))
@@ -1144,7 +1179,8 @@ class Recurrente(BasePaymentProvider):
 
     def refund_control_render(self, request, refund):
         """Renderizar información de reembolso para el panel de control"""
-        if not refund.info_data:
+        info_data = refund.info_data
+        if not info_data:
             return _('No hay información disponible sobre este reembolso')
 
         template = """
@@ -1158,7 +1194,7 @@ class Recurrente(BasePaymentProvider):
         """
         
         # Determinar clase de estilo según el estado
-        status = refund.info_data.get('status', 'pending')
+        status = info_data.get('status', 'pending')
         status_class = {
             'succeeded': 'success',
             'pending': 'warning',
@@ -1179,29 +1215,31 @@ class Recurrente(BasePaymentProvider):
         }.get(status, status)
         
         return template.format(
-            refund_id=refund.info_data.get('refund_id', 'N/A'),
-            payment_id=refund.info_data.get('payment_id', 'N/A'),
+            refund_id=info_data.get('refund_id', 'N/A'),
+            payment_id=info_data.get('payment_id', 'N/A'),
             status=status_text,
             status_class=status_class,
-            created_at=refund.info_data.get('created_at', 'N/A'),
+            created_at=info_data.get('created_at', 'N/A'),
             amount=amount,
             currency=currency
         )
 
     def api_payment_details(self, payment):
         """Proveer detalles de pago para la API"""
+        info_data = payment.info_data
         return {
-            'checkout_id': payment.info_data.get('checkout_id'),
-            'payment_id': payment.info_data.get('payment_id'),
-            'status': payment.info_data.get('status')
+            'checkout_id': info_data.get('checkout_id'),
+            'payment_id': info_data.get('payment_id'),
+            'status': info_data.get('status')
         }
 
     def api_refund_details(self, refund):
         """Proveer detalles de reembolso para la API"""
+        info_data = refund.info_data
         return {
-            'refund_id': refund.info_data.get('refund_id'),
-            'payment_id': refund.info_data.get('payment_id'),
-            'status': refund.info_data.get('status')
+            'refund_id': info_data.get('refund_id'),
+            'payment_id': info_data.get('payment_id'),
+            'status': info_data.get('status')
         }
 
     def get_payment_info_text(self, payment):
@@ -1211,11 +1249,11 @@ class Recurrente(BasePaymentProvider):
         Esta información se muestra en la página de confirmación del pedido,
         en los correos electrónicos y en el panel de administración.
         """
-        if not payment.info_data:
+        # info_data decodifica el JSON en cada acceso y ya devuelve un dict nuevo,
+        # así que se lee una sola vez y se modifica directamente sin copiarlo
+        payment_info = payment.info_data
+        if not payment_info:
             return _('No hay información disponible sobre este pago')
-
-        # Crear una copia de los datos y procesarlos para la visualización
-        payment_info = payment.info_data.copy()
         
         # Mapear campos de la respuesta de Recurrente a los campos que espera la plantilla
         
@@ -1225,58 +1263,37 @@ class Recurrente(BasePaymentProvider):
         elif not payment_info.get('status'):
             payment_info['status'] = 'succeeded' if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED else 'pending'
         
-        # IDs y referencias
-        if payment_info.get('external_payment_id'):
-            payment_info['payment_id'] = payment_info['external_payment_id']
-        
-        if payment_info.get('external_checkout_id'):
-            payment_info['checkout_id'] = payment_info['external_checkout_id']
+        # IDs, referencias y demás campos que la plantilla espera con otro nombre
+        for src, dst in self._PAYMENT_INFO_ALIASES:
+            value = payment_info.get(src)
+            if value:
+                payment_info[dst] = value
         
         # Número de recibo o transacción
-        if payment_info.get('receipt_number'):
-            payment_info['numero_recibo'] = payment_info['receipt_number']
-        elif payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
+        if not payment_info.get('receipt_number') and payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
             payment_info['numero_recibo'] = f"R{payment.pk}"
         
-        # Código de autorización
-        if payment_info.get('authorization_code'):
-            payment_info['codigo_autorizacion'] = payment_info['authorization_code']
-            
         # Fecha y hora
-        if payment_info.get('created_at_recurrente'):
-            payment_info['created'] = payment_info['created_at_recurrente']
-            payment_info['fecha_pago'] = payment_info['created_at_recurrente']
-        elif not payment_info.get('created'):
-            payment_info['created'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-            payment_info['fecha_pago'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        if not payment_info.get('created_at_recurrente') and not payment_info.get('created'):
+            now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+            payment_info['created'] = now
+            payment_info['fecha_pago'] = now
         
         # Método de pago
-        if payment_info.get('payment_method_type'):
-            payment_info['payment_method'] = payment_info['payment_method_type']
-            payment_info['metodo_pago'] = payment_info['payment_method_type']
-        elif payment_info.get('card_network'):
-            payment_info['metodo_pago'] = f"Tarjeta {payment_info['card_network']}"
-        else:
-            payment_info['metodo_pago'] = "Tarjeta"
+        card_network = payment_info.get('card_network')
+        if not payment_info.get('payment_method_type'):
+            payment_info['metodo_pago'] = f"Tarjeta {card_network}" if card_network else "Tarjeta"
         
         # Información de la tarjeta
-        if payment_info.get('card_network'):
-            payment_info['card_network'] = payment_info['card_network']
-        
-        if payment_info.get('card_last4'):
-            payment_info['card_last4'] = payment_info['card_last4']
-            if payment_info.get('metodo_pago'):
-                payment_info['metodo_pago'] += f" •••• {payment_info['card_last4']}"
+        card_last4 = payment_info.get('card_last4')
+        if card_last4 and payment_info.get('metodo_pago'):
+            payment_info['metodo_pago'] += f" •••• {card_last4}"
         
         # Información del cliente
-        if payment_info.get('customer_name'):
-            payment_info['customer_name'] = payment_info['customer_name']
-        elif payment.order and payment.order.invoice_address and payment.order.invoice_address.name:
+        if not payment_info.get('customer_name') and payment.order and payment.order.invoice_address and payment.order.invoice_address.name:
             payment_info['customer_name'] = payment.order.invoice_address.name
         
-        if payment_info.get('customer_email'):
-            payment_info['customer_email'] = payment_info['customer_email']
-        elif payment.order and payment.order.email:
+        if not payment_info.get('customer_email') and payment.order and payment.order.email:
             payment_info['customer_email'] = payment.order.email
             
         # Información del comercio
@@ -1284,14 +1301,13 @@ class Recurrente(BasePaymentProvider):
             payment_info['comercio_nombre'] = payment.order.event.organizer.name
         
         # Monto
-        if payment_info.get('amount_in_cents'):
-            payment_info['amount_in_cents'] = payment_info['amount_in_cents']
-        elif payment.amount:
-            # Convertir a centavos
-            payment_info['amount_in_cents'] = int(payment.amount * 100)
-            
-        if not payment_info.get('amount') and payment.amount:
-            payment_info['amount'] = float(payment.amount)
+        amount = payment.amount
+        if amount:
+            if not payment_info.get('amount_in_cents'):
+                # Convertir a centavos desplazando el exponente del Decimal
+                payment_info['amount_in_cents'] = int(amount.scaleb(2))
+            if not payment_info.get('amount'):
+                payment_info['amount'] = float(amount)
             
         if not payment_info.get('currency') and payment.order:
             payment_info['currency'] = payment.order.event.currency
@@ -1299,10 +1315,10 @@ class Recurrente(BasePaymentProvider):
         # Descripción del producto
         if payment.order and payment.order.event:
             producto = payment.order.event.name
-            if payment.order.positions.exists():
-                position = payment.order.positions.first()
-                if position.item:
-                    producto = position.item.name
+            # Una sola consulta LIMIT 1 en lugar de exists() + first()
+            positions = payment.order.positions.all()[:1]
+            if positions and positions[0].item:
+                producto = positions[0].item.name
             payment_info['producto_descripcion'] = producto
             payment_info['producto_titulo'] = producto
             
@@ -1317,7 +1333,7 @@ class Recurrente(BasePaymentProvider):
             payment_info['estado'] = 'CANCELADO'
         
         # Usar la plantilla con los datos procesados
-        template = get_template('pretix_recurrente/payment_info.html')
+        template = self._get_template('pretix_recurrente/payment_info.html')
         ctx = {
             'payment_info': payment_info,
             'payment': payment,
@@ -1331,11 +1347,11 @@ class Recurrente(BasePaymentProvider):
 
         Esta información se incluye en los correos de confirmación de pago.
         """
-        if not payment.info_data:
-            return None
-
         # Asegurarnos de que tengamos todos los datos necesarios para la plantilla
-        payment_info = payment.info_data.copy()
+        # (info_data ya devuelve un dict nuevo, no hace falta copiarlo)
+        payment_info = payment.info_data
+        if not payment_info:
+            return None
         
         # Campos obligatorios con valores predeterminados si no existen
         if not payment_info.get('status'):
@@ -1344,39 +1360,39 @@ class Recurrente(BasePaymentProvider):
         if not payment_info.get('receipt_number') and payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
             payment_info['receipt_number'] = f"R{payment.pk}"
             
+        fecha_actual = datetime.now().strftime('%d/%m/%Y %H:%M')
         if not payment_info.get('transaction_date'):
-            payment_info['transaction_date'] = payment_info.get('created', datetime.now().strftime('%d/%m/%Y %H:%M'))
+            payment_info['transaction_date'] = payment_info.get('created', fecha_actual)
             
         if not payment_info.get('amount') and payment.amount:
             payment_info['amount'] = float(payment.amount)
         
+        order = payment.order
+        currency = order.event.currency
+        
         # Intentar enviar el correo con manejo de errores
         try:
+            ctx = {
+                'payment_info': payment_info,
+                'payment': payment,
+                'order': order,
+                'currency': currency,
+            }
             return {
                 'subject': _('Información de pago'),
-                'text': get_template('pretix_recurrente/email/order_paid.txt').render({
-                    'payment_info': payment_info,
-                    'payment': payment,
-                    'order': payment.order,
-                    'currency': payment.order.event.currency,
-                }),
-                'html': get_template('pretix_recurrente/email/order_paid.html').render({
-                    'payment_info': payment_info,
-                    'payment': payment,
-                    'order': payment.order,
-                    'currency': payment.order.event.currency,
-                }),
+                'text': self._get_template('pretix_recurrente/email/order_paid.txt').render(ctx),
+                'html': self._get_template('pretix_recurrente/email/order_paid.html').render(ctx),
             }
         except Exception as e:
             logger.exception(f"Error al renderizar plantilla de email para pago {payment.pk}: {str(e)}")
             
             # Crear una versión simplificada en caso de error con la plantilla
             texto_simple = f"""
-            Tu pago de {payment.amount} {payment.order.event.currency} para el pedido {payment.order.code} ha sido recibido.
+            Tu pago de {payment.amount} {currency} para el pedido {order.code} ha sido recibido.
             
             Estado del pago: {payment_info.get('status', 'Confirmado')}
             ID de referencia: {payment_info.get('payment_id', payment.pk)}
-            Fecha: {payment_info.get('transaction_date', datetime.now().strftime('%d/%m/%Y %H:%M'))}
+            Fecha: {payment_info.get('transaction_date', fecha_actual)}
             
             Gracias por tu compra.
             """
@@ -1384,7 +1400,7 @@ class Recurrente(BasePaymentProvider):
             return {
                 'subject': _('Información de pago'),
                 'text': texto_simple,
-                'html': f"<p>{texto_simple.replace(chr(10), '<br>')}</p>",
+                'html': f"<p>{texto_simple.translate(_NEWLINE_TO_BR)}</p>",
             }
 
     def matching_id(self, payment):
@@ -1395,15 +1411,22 @@ class Recurrente(BasePaymentProvider):
         """ID para hacer matching con sistemas externos para reembolsos"""
         return refund.info_data.get('refund_id', None)
 
+    @staticmethod
+    def _shredded_info(info):
+        """Devuelve la versión sin datos sensibles de info_data, o None si no hay nada que eliminar"""
+        if not info or info.get('shredded'):
+            return None
+        # Solo mantenemos los IDs de pago y checkout, eliminamos datos sensibles
+        return {
+            'payment_id': info.get('payment_id'),
+            'checkout_id': info.get('checkout_id'),
+            'shredded': True
+        }
+
     def shred_payment_info(self, obj):
         """Eliminar información sensible al eliminar pagos"""
-        if obj.info_data:
-            # Solo mantenemos los IDs de pago y checkout, eliminamos datos sensibles
-            new_info = {
-                'payment_id': obj.info_data.get('payment_id'),
-                'checkout_id': obj.info_data.get('checkout_id'),
-                'shredded': True
-            }
+        new_info = self._shredded_info(obj.info_data)
+        if new_info is not None:
             obj.info_data = new_info
             obj.save(update_fields=['info'])
 
@@ -1422,17 +1445,22 @@ class Recurrente(BasePaymentProvider):
 
         try:
             # Actualizar la información del pago con el estado cancelado
-            payment.info_data = payment.info_data or {}
-            payment.info_data.update({
+            # info_data devuelve una copia nueva en cada acceso: modificarla localmente y reasignarla
+            info = payment.info_data or {}
+            info.update({
                 'status': 'canceled',
                 'canceled_by_user': True,
                 'cancel_date': datetime.now().isoformat(),
                 'cancel_reason': 'Usuario abandonó el proceso de pago'
             })
-            payment.save(update_fields=['info'])
+            payment.info_data = info
+
+            # Guardar la información y el cambio de estado en una sola transacción
+            with transaction.atomic():
+                payment.save(update_fields=['info'])
 
-            # Llamar al método de la clase base para marcar el pago como cancelado en Pretix
-            super().cancel_payment(payment)
+                # Llamar al método de la clase base para marcar el pago como cancelado en Pretix
+                super().cancel_payment(payment)
 
             logger.info(f"Pago {payment.pk} cancelado exitosamente")
 
@@ -1441,16 +1469,25 @@ class Recurrente(BasePaymentProvider):
             raise PaymentException(_("Error al cancelar el pago: {}").format(str(e)))
 
     def _get_api_settings(self, event):
-        """Obtener configuración de API para un evento específico"""
+        """
+        Obtener configuración de API para un evento específico.
+
+        El resultado se guarda en la instancia del proveedor, que vive lo que dura
+        la petición, así que los cambios de configuración se ven en la siguiente.
+        """
+        api_settings = self._api_settings_cache.get(event.pk)
+        if api_settings is not None:
+            return api_settings
         try:
             settings = SettingsSandbox('payment', 'recurrente', event)
-            return {
+            api_settings = self._api_settings_cache[event.pk] = {
                 'public_key': settings.get('api_key', ''),
                 'secret_key': settings.get('api_secret', ''),
                 'webhook_secret': settings.get('webhook_secret', ''),
                 'ignore_ssl': settings.get('ignore_ssl', as_type=bool, default=False),
                 'test_mode': settings.get('test_mode', as_type=bool, default=False),
             }
+            return api_settings
         except Exception as e:
             logger.exception(f"Error al obtener configuración de API: {e}")
             return {
@@ -1469,6 +1506,147 @@ from pretix.base.signals import register_payment_providers
 def register_payment_provider(sender, **kwargs):
     return Recurrente  # Solo retornamos la clase, no una instancia
 
+# Tamaño máximo de la página de recibo que se descarga para extraer datos
+_RECEIPT_MAX_BYTES = 2 * 1024 * 1024
+
+# Segundos que se conservan en caché los datos extraídos de un recibo
+_RECEIPT_CACHE_TIMEOUT = 300
+
+# Expresiones regulares para extraer datos del recibo de Recurrente,
+# compiladas una sola vez al cargar el módulo
+_RECEIPT_NUMBER_RES = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'Receipt number\s*[:\n]\s*([0-9-]+)',  # Inglés
+    r'Número de recibo\s*[:\n]\s*([0-9-]+)',  # Español
+    r'receipt_number"[^>]*>([0-9-]+)',      # HTML
+    r'recibo"[^>]*>([0-9-]+)',              # HTML
+    r'number"[^>]*>\s*([0-9]{4}-[0-9]{3})', # Formato típico Recurrente en JSON/DOM
+    r'([0-9]{4}-[0-9]{3})'                  # Formato típico de Recurrente
+))
+
+_AUTH_CODE_RES = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'Authorization Code\s*[:\n]\s*([0-9A-Z]+)',  # Inglés
+    r'Código de Autorización\s*[:\n]\s*([0-9A-Z]+)',  # Español
+    r'authorization_code"[^>]*>([0-9A-Z]+)',      # HTML
+    r'codigo_autorizacion"[^>]*>([0-9A-Z]+)',     # HTML
+    r'auth-?code"[^>]*>([0-9A-Z]+)',               # HTML alternativo
+    r'auth":\s*"([0-9A-Z]+)"',                    # JSON 
+    r'authorization":\s*"([0-9A-Z]+)"',           # JSON
+    r'authorizationCode":\s*"([0-9A-Z]+)"'        # JSON camelCase
+))
+
+_CARD_NETWORK_RES = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'(visa|mastercard|amex|american express|diners club|discover|jcb)\s+\*+',  # Formato común
+    r'payment_method[^>]*>(visa|mastercard|amex|american express|diners club|discover|jcb)',  # HTML
+    r'card-?type"[^>]*>(visa|mastercard|amex|american express|diners club|discover|jcb)',  # HTML
+    r'card-?brand"[^>]*>(visa|mastercard|amex|american express|diners club|discover|jcb)',   # HTML
+    r'network":\s*"(visa|mastercard|amex|american express|diners club|discover|jcb)"',  # JSON
+    r'card_network":\s*"(visa|mastercard|amex|american express|diners club|discover|jcb)"',  # JSON
+    r'brand":\s*"(visa|mastercard|amex|american express|diners club|discover|jcb)"'   # JSON
+))
+
+_CARD_LAST4_RES = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'\*+([0-9]{4})\b',  # Formato común: **** 1234
+    r'card-?last4"[^>]*>([0-9]{4})',  # HTML
+    r'last4"[^>]*>([0-9]{4})',        # HTML
+    r'last4":\s*"([0-9]{4})"',        # JSON
+    r'ending in ([0-9]{4})',          # Texto en inglés
+    r'terminada en ([0-9]{4})'        # Texto en español
+))
+
+# Fragmentos de JSON que puedan contener información de pago
+_JSON_BLOB_RES = tuple(re.compile(p, re.DOTALL) for p in (
+    r'window\.__INITIAL_STATE__\s*=\s*({.*})',
+    r'window\.__CHECKOUT_DATA__\s*=\s*({.*})',
+    r'window\.__PAYMENT_DATA__\s*=\s*({.*})',
+    r'var\s+checkoutData\s*=\s*({.*})',
+    r'var\s+paymentData\s*=\s*({.*})',
+    r'data-payment-info\s*=\s*\'({.*})\'',
+    r'data-payment-info\s*=\s*"({.*})"'
+))
+
+_SCRIPT_RE = re.compile(r'<script[^>]*>(.*?)</script>', re.DOTALL)
+_SCRIPT_PAYMENT_KEY_RE = re.compile(r'[{,]\s*"(card|payment|receipt)":')
+_SCRIPT_JSON_OBJECT_RE = re.compile(r'({[^}]*"(card|payment|receipt)":[^}]*})')
+
+# Campos del recibo que, una vez encontrados todos, hacen innecesario seguir buscando
+_RECEIPT_FIELDS = ('receipt_number', 'authorization_code', 'card_network', 'card_last4')
+
+def _receipt_complete(data):
+    """Indica si ya se extrajeron todos los campos del recibo"""
+    return all(data.get(field) for field in _RECEIPT_FIELDS)
+
+def _first_group(regexes, text):
+    """
+    Devuelve el primer grupo de la primera expresión que coincida en el texto.
+
+    Las expresiones se evalúan en orden de prioridad y la búsqueda se detiene
+    en la primera coincidencia.
+
+    Args:
+        regexes: Secuencia de expresiones regulares compiladas
+        text: Texto en el que buscar
+
+    Returns:
+        str: Valor capturado sin espacios, o None si ninguna coincide
+    """
+    for rx in regexes:
+        match = rx.search(text)
+        if match:
+            return match.group(1).strip()
+    return None
+
+# Claves del JSON embebido en la página de recibo que contienen datos del pago
+_RECEIPT_JSON_KEYS = frozenset({
+    'receipt_number', 'receiptNumber', 'receipt',
+    'authorization_code', 'authorizationCode', 'auth',
+    'card', 'payment_method', 'paymentMethod',
+})
+
+def _collect_json_keys(obj, wanted):
+    """
+    Recorre un JSON anidado en anchura y recoge el primer valor no vacío de cada clave buscada.
+
+    Args:
+        obj: Objeto JSON ya decodificado (dict, list o escalar)
+        wanted: Conjunto de claves a buscar
+
+    Returns:
+        dict: Clave encontrada -> valor, priorizando los niveles menos profundos
+    """
+    found = {}
+    pending = deque([obj])
+    while pending:
+        node = pending.popleft()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in wanted and value and key not in found:
+                    found[key] = value
+                if isinstance(value, (dict, list)):
+                    pending.append(value)
+        elif isinstance(node, list):
+            pending.extend(node)
+    return found
+
+def _first_of(found, keys):
+    """Devuelve el valor de la primera clave de ``keys`` presente en ``found``"""
+    for key in keys:
+        if key in found:
+            return found[key]
+    return None
+
+def _iter_script_bodies(html_content):
+    """
+    Itera sobre el contenido de las etiquetas ``<script>`` de la página.
+
+    Usa el parser de ``selectolax`` si está instalado y recurre a una
+    expresión regular en caso contrario.
+    """
+    if HTMLParser is not None:
+        for node in HTMLParser(html_content).css('script'):
+            yield node.text() or ''
+    else:
+        yield from _SCRIPT_RE.findall(html_content)
+
 def scrape_recurrente_receipt(checkout_url):
     """
     Extrae los datos del recibo directamente de la página web de Recurrente
@@ -1482,17 +1660,26 @@ def scrape_recurrente_receipt(checkout_url):
     if not checkout_url:
         return {}
     
+    # Los recibos no cambian: reutilizar el resultado de una extracción reciente
+    cache_key = 'recurrente_receipt_' + hashlib.sha1(checkout_url.encode('utf-8')).hexdigest()
+    cached_data = cache.get(cache_key)
+    if cached_data is not None:
+        logger.info(f"Usando datos del recibo en caché para: {checkout_url}")
+        return cached_data
+    
     try:
         logger.info(f"Intentando extraer datos del recibo desde: {checkout_url}")
         
-        # Realizar petición GET a la URL
-        response = requests.get(checkout_url, timeout=15)
-        if response.status_code != 200:
-            logger.warning(f"Error al consultar la página de recibo: {response.status_code}")
-            return {}
+        # Realizar petición GET a la URL, leyendo como máximo _RECEIPT_MAX_BYTES
+        with http_session.get(checkout_url, stream=True, timeout=(5, 15)) as response:
+            if response.status_code != 200:
+                logger.warning(f"Error al consultar la página de recibo: {response.status_code}")
+                return {}
+            raw = response.raw.read(_RECEIPT_MAX_BYTES, decode_content=True)
+            encoding = response.encoding or 'utf-8'
         
         # Analizar el contenido HTML
-        html_content = response.text
+        html_content = raw.decode(encoding, errors='replace')
         logger.info(f"Contenido HTML obtenido, longitud: {len(html_content)}")
         
         # Extraer datos con expresiones regulares
@@ -1501,115 +1688,47 @@ def scrape_recurrente_receipt(checkout_url):
         # Buscar campos específicos que aparecen en el recibo de Recurrente
         
         # Extraer número de recibo
-        receipt_number_patterns = [
-            r'Receipt number\s*[:\n]\s*([0-9-]+)',  # Inglés
-            r'Número de recibo\s*[:\n]\s*([0-9-]+)',  # Español
-            r'receipt_number"[^>]*>([0-9-]+)',      # HTML
-            r'recibo"[^>]*>([0-9-]+)',              # HTML
-            r'number"[^>]*>\s*([0-9]{4}-[0-9]{3})', # Formato típico Recurrente en JSON/DOM
-            r'([0-9]{4}-[0-9]{3})'                  # Formato típico de Recurrente
-        ]
-        
-        for pattern in receipt_number_patterns:
-            match = re.search(pattern, html_content, re.IGNORECASE)
-            if match:
-                data['receipt_number'] = match.group(1).strip()
-                logger.info(f"Encontrado número de recibo: {data['receipt_number']}")
-                break
+        value = _first_group(_RECEIPT_NUMBER_RES, html_content)
+        if value:
+            data['receipt_number'] = value
+            logger.info(f"Encontrado número de recibo: {data['receipt_number']}")
         
         # Extraer código de autorización
-        auth_code_patterns = [
-            r'Authorization Code\s*[:\n]\s*([0-9A-Z]+)',  # Inglés
-            r'Código de Autorización\s*[:\n]\s*([0-9A-Z]+)',  # Español
-            r'authorization_code"[^>]*>([0-9A-Z]+)',      # HTML
-            r'codigo_autorizacion"[^>]*>([0-9A-Z]+)',     # HTML
-            r'auth-?code"[^>]*>([0-9A-Z]+)',               # HTML alternativo
-            r'auth":\s*"([0-9A-Z]+)"',                    # JSON 
-            r'authorization":\s*"([0-9A-Z]+)"',           # JSON
-            r'authorizationCode":\s*"([0-9A-Z]+)"'        # JSON camelCase
-        ]
-        
-        for pattern in auth_code_patterns:
-            match = re.search(pattern, html_content, re.IGNORECASE)
-            if match:
-                data['authorization_code'] = match.group(1).strip()
-                logger.info(f"Encontrado código de autorización: {data['authorization_code']}")
-                break
+        value = _first_group(_AUTH_CODE_RES, html_content)
+        if value:
+            data['authorization_code'] = value
+            logger.info(f"Encontrado código de autorización: {data['authorization_code']}")
         
         # Extraer información de la tarjeta - Red (VISA, Mastercard, etc)
-        card_network_patterns = [
-            r'(visa|mastercard|amex|american express|diners club|discover|jcb)\s+\*+',  # Formato común
-            r'payment_method[^>]*>(visa|mastercard|amex|american express|diners club|discover|jcb)',  # HTML
-            r'card-?type"[^>]*>(visa|mastercard|amex|american express|diners club|discover|jcb)',  # HTML
-            r'card-?brand"[^>]*>(visa|mastercard|amex|american express|diners club|discover|jcb)',   # HTML
-            r'network":\s*"(visa|mastercard|amex|american express|diners club|discover|jcb)"',  # JSON
-            r'card_network":\s*"(visa|mastercard|amex|american express|diners club|discover|jcb)"',  # JSON
-            r'brand":\s*"(visa|mastercard|amex|american express|diners club|discover|jcb)"'   # JSON
-        ]
-        
-        for pattern in card_network_patterns:
-            match = re.search(pattern, html_content, re.IGNORECASE)
-            if match:
-                data['card_network'] = match.group(1).strip().upper()
-                logger.info(f"Encontrada red de tarjeta: {data['card_network']}")
-                break
+        value = _first_group(_CARD_NETWORK_RES, html_content)
+        if value:
+            data['card_network'] = value.upper()
+            logger.info(f"Encontrada red de tarjeta: {data['card_network']}")
         
         # Extraer últimos 4 dígitos de la tarjeta
-        card_last4_patterns = [
-            r'\*+([0-9]{4})\b',  # Formato común: **** 1234
-            r'card-?last4"[^>]*>([0-9]{4})',  # HTML
-            r'last4"[^>]*>([0-9]{4})',        # HTML
-            r'last4":\s*"([0-9]{4})"',        # JSON
-            r'ending in ([0-9]{4})',          # Texto en inglés
-            r'terminada en ([0-9]{4})'        # Texto en español
-        ]
-        
-        for pattern in card_last4_patterns:
-            match = re.search(pattern, html_content, re.IGNORECASE)
-            if match:
-                data['card_last4'] = match.group(1).strip()
-                logger.info(f"Encontrados últimos 4 dígitos: {data['card_last4']}")
-                break
+        value = _first_group(_CARD_LAST4_RES, html_content)
+        if value:
+            data['card_last4'] = value
+            logger.info(f"Encontrados últimos 4 dígitos: {data['card_last4']}")
         
         # Buscar fragmentos de JSON que puedan contener información de pago
-        json_patterns = [
-            r'window\.__INITIAL_STATE__\s*=\s*({.*})',
-            r'window\.__CHECKOUT_DATA__\s*=\s*({.*})',
-            r'window\.__PAYMENT_DATA__\s*=\s*({.*})',
-            r'var\s+checkoutData\s*=\s*({.*})',
-            r'var\s+paymentData\s*=\s*({.*})',
-            r'data-payment-info\s*=\s*\'({.*})\'',
-            r'data-payment-info\s*=\s*"({.*})"'
-        ]
-        
-        for pattern in json_patterns:
-            match = re.search(pattern, html_content, re.DOTALL)
+        for rx in _JSON_BLOB_RES:
+            if _receipt_complete(data):
+                break
+            match = rx.search(html_content)
             if match:
                 try:
                     json_str = match.group(1)
-                    json_data = json.loads(json_str)
+                    json_data = json_loads(json_str)
                     logger.info("Encontrado fragmento JSON con información")
                     
-                    # Buscar datos en el JSON anidado
-                    def search_nested_json(obj, fields):
-                        if isinstance(obj, dict):
-                            for field in fields:
-                                if field in obj:
-                                    return obj[field]
-                            for key, value in obj.items():
-                                result = search_nested_json(value, fields)
-                                if result:
-                                    return result
-                        elif isinstance(obj, list):
-                            for item in obj:
-                                result = search_nested_json(item, fields)
-                                if result:
-                                    return result
-                        return None
+                    # Recorrer el JSON anidado una sola vez recogiendo todas las claves de interés
+                    found = _collect_json_keys(json_data, _RECEIPT_JSON_KEYS)
+                    card = _first_of(found, ('card', 'payment_method', 'paymentMethod'))
                     
                     # Buscar datos específicos si no se encontraron antes
                     if not data.get('receipt_number'):
-                        receipt = search_nested_json(json_data, ['receipt_number', 'receiptNumber', 'receipt'])
+                        receipt = _first_of(found, ('receipt_number', 'receiptNumber', 'receipt'))
                         if receipt and isinstance(receipt, str):
                             data['receipt_number'] = receipt
                             logger.info(f"Encontrado número de recibo en JSON: {data['receipt_number']}")
@@ -1618,7 +1737,7 @@ def scrape_recurrente_receipt(checkout_url):
                             logger.info(f"Encontrado número de recibo en JSON: {data['receipt_number']}")
                     
                     if not data.get('authorization_code'):
-                        auth_code = search_nested_json(json_data, ['authorization_code', 'authorizationCode', 'auth'])
+                        auth_code = _first_of(found, ('authorization_code', 'authorizationCode', 'auth'))
                         if auth_code and isinstance(auth_code, str):
                             data['authorization_code'] = auth_code
                             logger.info(f"Encontrado código de autorización en JSON: {data['authorization_code']}")
@@ -1627,7 +1746,6 @@ def scrape_recurrente_receipt(checkout_url):
                             logger.info(f"Encontrado código de autorización en JSON: {data['authorization_code']}")
                     
                     if not data.get('card_network'):
-                        card = search_nested_json(json_data, ['card', 'payment_method', 'paymentMethod'])
                         if card and isinstance(card, dict):
                             if 'network' in card:
                                 data['card_network'] = card['network'].upper()
@@ -1637,26 +1755,28 @@ def scrape_recurrente_receipt(checkout_url):
                                 logger.info(f"Encontrada red de tarjeta en JSON: {data['card_network']}")
                     
                     if not data.get('card_last4'):
-                        card = search_nested_json(json_data, ['card', 'payment_method', 'paymentMethod'])
                         if card and isinstance(card, dict) and 'last4' in card:
                             data['card_last4'] = card['last4']
                             logger.info(f"Encontrados últimos 4 dígitos en JSON: {data['card_last4']}")
                     
-                except json.JSONDecodeError:
+                except ValueError:
                     logger.warning("Error al decodificar JSON encontrado en la página")
                 except Exception as e:
                     logger.warning(f"Error al procesar JSON: {str(e)}")
         
         # Extraer información directamente de scripts JSON en la página
-        script_tags = re.findall(r'<script[^>]*>(.*?)</script>', html_content, re.DOTALL)
-        for script in script_tags:
+        # (solo si las búsquedas anteriores no encontraron todos los campos)
+        script_bodies = () if _receipt_complete(data) else _iter_script_bodies(html_content)
+        for script in script_bodies:
+            if _receipt_complete(data):
+                break
             # Buscar objetos JSON que puedan contener información de pago
             try:
                 # Buscar patrones de objetos JSON con información relevante
-                json_matches = re.findall(r'[{,]\s*"(card|payment|receipt)":', script)
+                json_matches = _SCRIPT_PAYMENT_KEY_RE.findall(script)
                 if json_matches:
                     # Intentar extraer el objeto JSON completo
-                    json_obj_match = re.search(r'({[^}]*"(card|payment|receipt)":[^}]*})', script)
+                    json_obj_match = _SCRIPT_JSON_OBJECT_RE.search(script)
                     if json_obj_match:
                         try:
                             # Limpiar el JSON para que sea válido
@@ -1665,7 +1785,7 @@ def scrape_recurrente_receipt(checkout_url):
                             if not json_str.startswith('{'): json_str = '{' + json_str
                             if not json_str.endswith('}'): json_str = json_str + '}'
                             
-                            json_data = json.loads(json_str)
+                            json_data = json_loads(json_str)
                             
                             # Extraer datos si existen
                             if 'receipt' in json_data and not data.get('receipt_number'):
@@ -1699,7 +1819,9 @@ def scrape_recurrente_receipt(checkout_url):
         
         # Verificar si se extrajo algún dato
         if data:
-            logger.info(f"Datos extraídos del recibo: {data}")
+            logger.debug("Datos extraídos del recibo: %s", data)
+            # Solo se guardan resultados con datos, para reintentar tras fallos transitorios
+            cache.set(cache_key, data, _RECEIPT_CACHE_TIMEOUT)
             return data
         else:
             logger.warning(f"No se pudo extraer información del recibo desde la URL {checkout_url}")
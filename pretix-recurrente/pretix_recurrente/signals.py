@@ -1,47 +1,69 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.urls import resolve, reverse
 from django.utils.translation import gettext_lazy as _
-from pretix.base.signals import periodic_task, register_payment_providers
+from pretix.base.signals import register_payment_providers
 from pretix.control.signals import nav_event
-from pretix.base.models import Event
+from pretix.base.models import Event, Event_SettingsStore, Organizer_SettingsStore
+from django_scopes import scopes_disabled
 import logging
 from datetime import timedelta
 
+from .views.webhooks import WEBHOOK_CONFIG_SETTING_KEYS, webhook_config_cache_key
+
 logger = logging.getLogger('pretix.plugins.recurrente')
 
-@receiver(periodic_task, dispatch_uid="recurrente_update_pending_payments")
+
+@receiver(post_save, sender=Event_SettingsStore, dispatch_uid="recurrente_event_settings_saved")
+@receiver(post_delete, sender=Event_SettingsStore, dispatch_uid="recurrente_event_settings_deleted")
+def invalidate_event_webhook_config(sender, instance, **kwargs):
+    """
+    Descarta la configuración de webhook cacheada de un evento al cambiar su secreto
+    """
+    if instance.key in WEBHOOK_CONFIG_SETTING_KEYS:
+        event = instance.object
+        cache.delete(webhook_config_cache_key(event.organizer.slug, event.slug))
+
+
+@receiver(post_save, sender=Organizer_SettingsStore, dispatch_uid="recurrente_organizer_settings_saved")
+@receiver(post_delete, sender=Organizer_SettingsStore, dispatch_uid="recurrente_organizer_settings_deleted")
+def invalidate_organizer_webhook_config(sender, instance, **kwargs):
+    """
+    Descarta la configuración de webhook cacheada de todos los eventos del organizador
+    al cambiar su secreto global, que usan los eventos sin secreto propio
+    """
+    if instance.key in WEBHOOK_CONFIG_SETTING_KEYS:
+        organizer = instance.object
+        cache.delete_many([
+            webhook_config_cache_key(organizer.slug, event_slug)
+            for event_slug in organizer.events.values_list('slug', flat=True)
+        ])
+
+
+@receiver(post_save, sender=Event, dispatch_uid="recurrente_event_saved")
+def invalidate_event_webhook_config_testmode(sender, instance, update_fields=None, **kwargs):
+    """
+    Descarta la configuración de webhook cacheada al guardar el evento, que puede
+    haber cambiado de modo de pruebas
+    """
+    if update_fields is None or 'testmode' in update_fields:
+        cache.delete(webhook_config_cache_key(instance.organizer.slug, instance.slug))
+
+
 def update_pending_payments(sender, **kwargs):
     """
     Tarea periódica para actualizar el estado de pagos pendientes en Recurrente
 
-    Esta tarea se ejecutará automáticamente en el intervalo configurado en Pretix.
-    
-    NOTA: Esta funcionalidad ha sido deshabilitada porque puede interferir con la
-    confirmación normal a través de webhooks. Los webhooks ya son la manera principal
-    y preferida para actualizar el estado de los pagos.
-    """
-    # Retornar inmediatamente para deshabilitar la actualización periódica
-    # Los webhooks de Recurrente ya se encargan de actualizar los pagos
-    return {
-        'events': 0,
-        'total': 0,
-        'updated': 0,
-        'errors': 0,
-        'confirmed': 0
-    }
-    
-    # Comentamos el código original a continuación
+    NOTA: No está conectada a la señal periodic_task porque puede interferir con la
+    confirmación normal a través de webhooks, que son la manera principal y preferida
+    para actualizar el estado de los pagos; así Django tampoco la despacha en cada ciclo.
     """
+    from .payment import Recurrente
     from .utils import update_pending_payments_status
 
     logger.info("Iniciando actualización periódica de pagos pendientes de Recurrente")
 
-    # Recuperar todos los eventos activos
-    events = Event.objects.all().filter(
-        plugins__contains="pretix_recurrente",
-        live=True
-    )
-
     total_stats = {
         'events': 0,
         'total': 0,
@@ -50,46 +72,52 @@ def update_pending_payments(sender, **kwargs):
         'confirmed': 0
     }
 
-    # Procesar cada evento
-    for event in events:
-        try:
-            # Verificar si el plugin está habilitado
-            if not event.settings.get('payment_recurrente__enabled', as_type=bool):
-                continue
-
-            # Obtener credenciales
-            api_key = event.settings.get('payment_recurrente_api_key')
-            api_secret = event.settings.get('payment_recurrente_api_secret')
-
-            if not api_key or not api_secret:
-                continue
-
-            # Inicializar proveedor de pagos para obtener endpoints
-            from .payment import Recurrente
-            provider = Recurrente(event)
-
-            # Llamar a la función de actualización
-            ignore_ssl = event.settings.get('payment_recurrente_ignore_ssl', False)
-            stats = update_pending_payments_status(
-                event=event,
-                api_key=api_key,
-                api_secret=api_secret,
-                get_api_endpoints=provider.get_api_endpoints,
-                ignore_ssl=ignore_ssl
-            )
-
-            # Actualizar estadísticas totales
-            total_stats['events'] += 1
-            total_stats['total'] += stats['total']
-            total_stats['updated'] += stats['updated']
-            total_stats['errors'] += stats['errors']
-            total_stats['confirmed'] += stats['confirmed']
-
-            if stats['total'] > 0:
-                logger.info(f"Actualización para evento {event.slug}: {stats['updated']} pagos actualizados, {stats['confirmed']} confirmados, {stats['errors']} errores")
-
-        except Exception as e:
-            logger.exception(f"Error al procesar evento {event.slug}: {str(e)}")
+    with scopes_disabled():
+        # Recuperar todos los eventos activos
+        events = Event.objects.filter(
+            plugins__contains="pretix_recurrente",
+            live=True
+        ).select_related('organizer')
+
+        # Procesar cada evento
+        for event in events:
+            try:
+                # Verificar si el plugin está habilitado
+                if not event.settings.get('payment_recurrente__enabled', as_type=bool):
+                    continue
+
+                # Obtener credenciales
+                api_key = event.settings.get('payment_recurrente_api_key')
+                api_secret = event.settings.get('payment_recurrente_api_secret')
+
+                if not api_key or not api_secret:
+                    continue
+
+                # Inicializar proveedor de pagos para obtener endpoints
+                provider = Recurrente(event)
+
+                # Llamar a la función de actualización
+                ignore_ssl = event.settings.get('payment_recurrente_ignore_ssl', False, as_type=bool)
+                stats = update_pending_payments_status(
+                    event=event,
+                    api_key=api_key,
+                    api_secret=api_secret,
+                    get_api_endpoints=provider.get_api_endpoints,
+                    ignore_ssl=ignore_ssl
+                )
+
+                # Actualizar estadísticas totales
+                total_stats['events'] += 1
+                total_stats['total'] += stats['total']
+                total_stats['updated'] += stats['updated']
+                total_stats['errors'] += stats['errors']
+                total_stats['confirmed'] += stats['confirmed']
+
+                if stats['total'] > 0:
+                    logger.info(f"Actualización para evento {event.slug}: {stats['updated']} pagos actualizados, {stats['confirmed']} confirmados, {stats['errors']} errores")
+
+            except Exception as e:
+                logger.exception(f"Error al procesar evento {event.slug}: {str(e)}")
 
     if total_stats['events'] > 0:
         logger.info(f"Actualización periódica finalizada: {total_stats['events']} eventos procesados, {total_stats['updated']} pagos actualizados, {total_stats['confirmed']} confirmados, {total_stats['errors']} errores")
@@ -97,7 +125,6 @@ def update_pending_payments(sender, **kwargs):
         logger.info("No se encontraron eventos con el plugin Recurrente habilitado")
 
     return total_stats
-    """
 
 
 # La siguiente función ha sido comentada porque la vista de pruebas no está implementada
@@ -1,13 +1,9 @@
 from django.urls import path
-from pretix.multidomain.urlreverse import eventreverse
-import logging
 from pretix_recurrente.views import (
     webhook, global_webhook, success, cancel, 
     update_payment_status, check_payment_status
 )
 
-logger = logging.getLogger('pretix.plugins.recurrente')
-
 event_patterns = [
     path('recurrente/webhook/', webhook, name='webhook'),
     path('recurrente/success/', success, name='success'),
@@ -3,16 +3,155 @@ import requests
 import json
 from datetime import datetime, timedelta
 from pretix.base.models import OrderPayment, Order, Quota
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.db import transaction
 from django.core.cache import cache
 from django_scopes import scopes_disabled
 import time
+import random
 import re
-import urllib.parse
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger('pretix.plugins.recurrente')
 
+# Sesión HTTP compartida: reutiliza conexiones TCP/TLS entre peticiones a Recurrente
+http_session = requests.Session()
+# pool_maxsize cubre los hilos del barrido de pagos pendientes más las peticiones web concurrentes
+http_session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+
+# Códigos HTTP transitorios ante los que vale la pena reintentar una consulta
+_RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+def get_with_retry(url, headers=None, timeout=10, verify=True, max_retries=3, base_delay=1.0):
+    """
+    Hace un GET con la sesión compartida, reintentando los fallos transitorios.
+
+    Reintenta ante errores de conexión, timeouts y respuestas 429/5xx con espera
+    exponencial y jitter (respetando ``Retry-After`` si viene en la respuesta).
+    Los demás errores 4xx se devuelven de inmediato.
+
+    Args:
+        url: URL a consultar
+        headers: Encabezados de la petición
+        timeout: Timeout de cada intento en segundos
+        verify: Si se verifica el certificado SSL
+        max_retries: Número máximo de reintentos tras el primer intento
+        base_delay: Espera base en segundos del primer reintento
+
+    Returns:
+        requests.Response: La última respuesta obtenida
+
+    Raises:
+        requests.RequestException: Si el último intento falla por conexión o timeout
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = http_session.get(url, headers=headers, timeout=timeout, verify=verify)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            retry_after = None
+        else:
+            if response.status_code not in _RETRY_STATUS_CODES or attempt == max_retries:
+                return response
+            retry_after = response.headers.get('Retry-After')
+        
+        delay = min(30, base_delay * 2 ** attempt) * (0.5 + random.random() * 0.5)
+        if retry_after and retry_after.isdigit():
+            delay = min(30, int(retry_after))
+        logger.info(f"Reintentando consulta a {url} en {delay:.1f}s (intento {attempt + 1} de {max_retries})")
+        time.sleep(delay)
+
+class _CircuitBreaker:
+    """
+    Circuit breaker en proceso para las consultas a la API de Recurrente.
+    
+    Tras ``threshold`` fallos consecutivos se abre durante ``cooldown`` segundos
+    y las consultas se omiten sin llegar a la red. Pasado ese tiempo se deja
+    pasar tráfico de nuevo: un éxito lo cierra y un fallo lo vuelve a abrir.
+    """
+    __slots__ = ('failures', 'opened_at', 'threshold', 'cooldown', '_lock')
+    
+    def __init__(self, threshold=5, cooldown=60):
+        self.failures = 0
+        self.opened_at = None
+        self.threshold = threshold
+        self.cooldown = cooldown
+        # Se comparte entre los hilos del barrido de pagos pendientes
+        self._lock = threading.Lock()
+    
+    def is_open(self):
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Medio abierto: un solo fallo más basta para volver a abrirlo
+                self.opened_at = None
+                self.failures = self.threshold - 1
+                return False
+            return True
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                logger.warning(f"API de Recurrente con {self.failures} fallos consecutivos: se suspenden las consultas durante {self.cooldown}s")
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+# Estado compartido por todas las consultas del proceso a la API de Recurrente
+api_circuit_breaker = _CircuitBreaker()
+
+def json_loads(data):
+    """
+    Decodifica JSON desde ``bytes`` o ``str``.
+
+    Usa ``orjson`` si está instalado (extra ``speedups``; parsea directamente
+    desde bytes) y recurre a la librería estándar ``json`` en caso contrario.
+    A diferencia de ``json``, ``orjson`` rechaza ``NaN`` e ``Infinity``, que no
+    son JSON válido.
+
+    Raises:
+        ValueError: Si el contenido no es un JSON válido
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(data):
+    """
+    Codifica a JSON como ``str``, listo para guardarse en un campo de texto.
+
+    Usa ``orjson`` si está instalado (extra ``speedups``) y recurre a la
+    librería estándar ``json`` en caso contrario. Ambos generan el mismo texto
+    compacto y sin escapar caracteres no ASCII, salvo en estos casos:
+
+    - ``NaN`` e ``Infinity``: ``orjson`` los escribe como ``null``; ``json``
+      los escribe tal cual (no es JSON válido, aunque ``json`` lo vuelve a leer).
+    - ``datetime``, ``UUID`` y dataclasses: ``orjson`` los serializa; ``json``
+      lanza ``TypeError``.
+
+    Raises:
+        TypeError: Si el contenido no es serializable a JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
 def safe_json_parse(response, default=None):
     """
     Parsea una respuesta HTTP a JSON de forma segura.
@@ -29,20 +168,42 @@ def safe_json_parse(response, default=None):
     if default is None:
         default = {}
         
-    # Verificar si hay contenido
-    if not response.text or not response.text.strip():
+    # Trabajar sobre los bytes para no decodificar el cuerpo más de una vez
+    body = response.content or b''
+    
+    # Verificar si hay contenido (isspace no crea una copia del cuerpo como strip)
+    if not body or body.isspace():
         logger.info(f"Respuesta vacía recibida (status code: {response.status_code})")
         return default
     
+    # Las páginas de error HTML (proxies, 502 de balanceadores) no son JSON:
+    # se descartan sin intentar parsearlas
+    content_type = response.headers.get('Content-Type', '')
+    if content_type.startswith('text/html'):
+        logger.warning(f"Respuesta HTML en lugar de JSON (status code: {response.status_code}, Content-Type: {content_type})")
+        return default
+    
     # Intentar parsear como JSON
     try:
-        return response.json()
+        return json_loads(body)
     except ValueError as e:
-        # Incluir los primeros 100 caracteres del texto para depuración
-        text_preview = response.text[:100] if response.text else "[texto vacío]"
+        # Incluir el inicio del cuerpo para depuración, decodificando solo ese fragmento
+        text_preview = body[:100].decode('utf-8', errors='replace')
         logger.warning(f"Error al parsear JSON de respuesta: {e}. Inicio del texto: '{text_preview}...'")
         return default
         
+# Textos descriptivos de los estados de Recurrente (traducciones perezosas,
+# se resuelven con el idioma activo al mostrarse)
+_STATUS_MAP = {
+    'pending': _("Pendiente"),
+    'paid': _("Pagado"),
+    'failed': _("Fallido"),
+    'canceled': _("Cancelado"),
+    'refunded': _("Reembolsado"),
+    'expired': _("Expirado"),
+}
+
+@lru_cache(maxsize=32)
 def get_descriptive_status(status):
     """
     Convierte un estado de Recurrente a un texto descriptivo.
@@ -54,18 +215,66 @@ def get_descriptive_status(status):
         str: Estado descriptivo
     """
     if not status:
-        return _("Pendiente")
-        
-    status_map = {
-        'pending': _("Pendiente"),
-        'paid': _("Pagado"),
-        'failed': _("Fallido"),
-        'canceled': _("Cancelado"),
-        'refunded': _("Reembolsado"),
-        'expired': _("Expirado"),
-    }
+        return _STATUS_MAP['pending']
     
-    return status_map.get(status.lower(), status)
+    return _STATUS_MAP.get(status.lower(), status)
+
+# Fracción de segundos; fromisoformat (Python < 3.11) solo acepta 3 o 6 dígitos
+_FRACTIONAL_SECONDS_RE = re.compile(r'\.\d+(?=[+-]\d{2}:?\d{2}$|$)')
+
+# Formatos alternativos, solo para fechas que fromisoformat no acepta
+_DATE_FALLBACK_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S",
+)
+
+def _parse_iso_datetime(date_str):
+    """
+    Parsea una fecha ISO-8601 de Recurrente.
+    
+    Usa ``datetime.fromisoformat`` (implementado en C) y solo recurre a
+    ``strptime`` si la fecha trae una variante que no reconoce.
+    
+    Args:
+        date_str: Fecha en formato ISO
+        
+    Returns:
+        datetime: Fecha parseada
+        
+    Raises:
+        ValueError: Si la fecha no tiene ningún formato reconocido
+    """
+    normalized = date_str[:-1] + '+00:00' if date_str.endswith('Z') else date_str
+    try:
+        return datetime.fromisoformat(normalized)
+    except ValueError:
+        pass
+    
+    try:
+        return datetime.fromisoformat(_FRACTIONAL_SECONDS_RE.sub('', normalized, count=1))
+    except ValueError:
+        pass
+    
+    for fmt in _DATE_FALLBACK_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Formato de fecha no reconocido: {date_str}")
+
+@lru_cache(maxsize=1024)
+def _format_iso_date(date_str):
+    """
+    Convierte una fecha ISO a 'dd/mm/aaaa HH:MM', o None si no se puede parsear.
+    
+    Cacheado porque las mismas fechas se repiten; los fallos también quedan
+    cacheados y no se vuelven a parsear.
+    """
+    try:
+        return _parse_iso_datetime(date_str).strftime('%d/%m/%Y %H:%M')
+    except (ValueError, TypeError, AttributeError):
+        return None
 
 def format_date(date_str, default=_("No disponible")):
     """
@@ -73,7 +282,7 @@ def format_date(date_str, default=_("No disponible")):
     
     Args:
         date_str: Fecha en formato ISO o None
-        default: Texto a mostrar si la fecha es None
+        default: Texto a mostrar si la fecha es None o no se puede parsear
         
     Returns:
         str: Fecha formateada o valor por defecto
@@ -82,12 +291,15 @@ def format_date(date_str, default=_("No disponible")):
         return default
         
     try:
-        dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-        return dt.strftime('%d/%m/%Y %H:%M')
-    except (ValueError, TypeError):
+        return _format_iso_date(date_str) or default
+    except TypeError:
+        # Valor no hashable (no es una fecha)
         return default
 
-def update_pending_payments_status(event, api_key, api_secret, get_api_endpoints, ignore_ssl=False):
+# Campos del checkout que el barrido ya guarda explícitamente y no se copian como api_*
+_CHECKOUT_EXCLUDED_KEYS = frozenset({'id', 'checkout_url', 'status', 'created_at', 'expires_at', 'payment'})
+
+def update_pending_payments_status(event, api_key, api_secret, get_api_endpoints, ignore_ssl=False, max_workers=8):
     """
     Actualiza el estado de pagos pendientes consultando la API de Recurrente.
     
@@ -100,6 +312,7 @@ def update_pending_payments_status(event, api_key, api_secret, get_api_endpoints
         api_secret: Clave secreta de API
         get_api_endpoints: Función para obtener los endpoints de API
         ignore_ssl: Si se debe ignorar la verificación SSL
+        max_workers: Número máximo de consultas simultáneas a la API
         
     Returns:
         dict: Estadísticas de la actualización (pagos actualizados, errores, etc.)
@@ -113,18 +326,24 @@ def update_pending_payments_status(event, api_key, api_secret, get_api_endpoints
     
     # Buscar pagos pendientes de Recurrente que tengan más de 5 minutos de antigüedad
     # y menos de 48 horas para evitar procesar pagos muy recientes o muy antiguos
-    min_age = datetime.now() - timedelta(minutes=5)
-    max_age = datetime.now() - timedelta(hours=48)
+    # OrderPayment.created es una fecha con zona horaria: comparar con un valor aware
+    now = timezone.now()
+    now_iso = now.isoformat()
+    min_age = now - timedelta(minutes=5)
+    max_age = now - timedelta(hours=48)
     
-    pending_payments = OrderPayment.objects.filter(
+    # Una sola consulta con el pedido incluido y el total se obtiene de la lista en
+    # lugar de un COUNT aparte. No se limitan las columnas: confirm() lee muchos
+    # campos del pago y del pedido y cada campo diferido costaría otra consulta
+    pending_payments = list(OrderPayment.objects.filter(
         order__event=event,
         provider='recurrente',
         state=OrderPayment.PAYMENT_STATE_PENDING,
         created__lt=min_age,
         created__gt=max_age
-    )
+    ).select_related('order'))
     
-    stats['total'] = pending_payments.count()
+    stats['total'] = len(pending_payments)
     if stats['total'] == 0:
         return stats
         
@@ -135,7 +354,13 @@ def update_pending_payments_status(event, api_key, api_secret, get_api_endpoints
         'X-SECRET-KEY': api_secret
     }
     
-    # Procesar cada pago pendiente
+    # Los endpoints dependen solo de la configuración del evento: obtenerlos una vez
+    checkout_url_template = get_api_endpoints()['get_checkout']
+    
+    # Preparar las consultas en el hilo principal (info_data puede tocar la BD).
+    # Esta info solo sirve para obtener el checkout_id: al guardar se vuelve a leer,
+    # porque puede haber cambiado mientras se consultaba la API
+    to_fetch = []
     for payment in pending_payments:
         try:
             # Verificar si tiene checkout_id
@@ -144,62 +369,203 @@ def update_pending_payments_status(event, api_key, api_secret, get_api_endpoints
                 logger.warning(f"Pago {payment.pk} no tiene checkout_id, no se puede actualizar")
                 continue
                 
-            # Obtener URL y realizar consulta
-            endpoints = get_api_endpoints()
-            get_checkout_url = endpoints['get_checkout'].format(checkout_id=checkout_id)
-            
-            logger.info(f"Actualizando automáticamente estado de pago {payment.pk} (checkout: {checkout_id})")
-            
-            response = requests.get(
+            # Obtener URL de consulta
+            get_checkout_url = checkout_url_template.format(checkout_id=checkout_id)
+            to_fetch.append((payment, checkout_id, get_checkout_url))
+        except Exception as e:
+            logger.exception(f"Error al preparar actualización del pago {payment.pk}: {str(e)}")
+            stats['errors'] += 1
+    
+    def fetch_checkout(item):
+        # Solo E/S de red: se ejecuta en los hilos del pool
+        payment, checkout_id, get_checkout_url = item
+        # Con la API caída no se lanzan consultas condenadas a agotar el timeout
+        if api_circuit_breaker.is_open():
+            return item, None, None
+        logger.info(f"Actualizando automáticamente estado de pago {payment.pk} (checkout: {checkout_id})")
+        try:
+            response = get_with_retry(
                 get_checkout_url,
                 headers=headers,
                 timeout=10,
                 verify=not ignore_ssl
             )
-            
-            if response.status_code >= 400:
-                logger.error(f"Error al consultar API para checkout {checkout_id}: {response.status_code}")
-                stats['errors'] += 1
-                continue
+        except Exception as e:
+            api_circuit_breaker.record_failure()
+            return item, None, e
+        if response.status_code >= 500:
+            api_circuit_breaker.record_failure()
+        else:
+            api_circuit_breaker.record_success()
+        return item, response, None
+    
+    # Consultar la API en paralelo y procesar cada respuesta en el hilo principal
+    # a medida que llega, sin esperar a las consultas más lentas
+    to_save = []
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_checkout, item) for item in to_fetch]
+        for future in as_completed(futures):
+            (payment, checkout_id, get_checkout_url), response, error = future.result()
+            try:
+                if error is not None:
+                    raise error
                 
-            # Procesar respuesta
-            checkout_data = safe_json_parse(response)
-            if not checkout_data:
-                stats['errors'] += 1
-                continue
+                if response is None:
+                    # Consulta omitida por el circuit breaker
+                    skipped += 1
+                    stats['errors'] += 1
+                    continue
                 
-            # Actualizar información del pago
-            payment.info_data.update({
-                'status': checkout_data.get('status', payment.info_data.get('status')),
-                'created_at': checkout_data.get('created_at', payment.info_data.get('created_at')),
-                'expires_at': checkout_data.get('expires_at', payment.info_data.get('expires_at')),
-                'last_updated': datetime.now().isoformat(),
-                'payment_id': checkout_data.get('payment', {}).get('id', payment.info_data.get('payment_id')),
-                'auto_updated': True
-            })
-            
-            # Registrar campos adicionales
-            for key, value in checkout_data.items():
-                if key not in ['id', 'checkout_url', 'status', 'created_at', 'expires_at', 'payment']:
-                    payment.info_data[f'api_{key}'] = value
-            
-            # Confirmar pago si está pagado
-            if checkout_data.get('status') == 'paid':
-                if payment.state != OrderPayment.PAYMENT_STATE_CONFIRMED:
-                    payment.confirm()
-                    stats['confirmed'] += 1
-                    logger.info(f"Pago {payment.pk} confirmado automáticamente")
-            else:
-                payment.save(update_fields=['info'])
+                if response.status_code >= 400:
+                    logger.error(f"Error al consultar API para checkout {checkout_id}: {response.status_code}")
+                    stats['errors'] += 1
+                    continue
+                    
+                # Procesar respuesta
+                checkout_data = safe_json_parse(response)
+                if not checkout_data:
+                    stats['errors'] += 1
+                    continue
+                    
+                if checkout_data.get('status') != 'paid':
+                    # La información se guarda al final en bloque, releída bajo bloqueo
+                    to_save.append((payment.pk, checkout_data))
+                    continue
                 
-            stats['updated'] += 1
-            
-        except Exception as e:
-            logger.exception(f"Error al actualizar pago {payment.pk}: {str(e)}")
-            stats['errors'] += 1
+                # Confirmar pago si está pagado (confirm() tiene efectos secundarios,
+                # no se puede agrupar). Un webhook pudo haber escrito en el pago mientras
+                # se consultaba la API: se parte de la info actual y no de la leída al
+                # inicio del barrido
+                payment.refresh_from_db(fields=['info', 'state'])
+                if payment.state not in (OrderPayment.PAYMENT_STATE_PENDING, OrderPayment.PAYMENT_STATE_CREATED):
+                    logger.info(f"Pago {payment.pk} cambió a estado {payment.state} durante el barrido, no se actualiza")
+                    continue
+                info = payment.info_data
+                info.update(_checkout_info_updates(info, checkout_data, now_iso))
+                payment.info_data = info
+                # confirm() guarda la info junto con el estado
+                payment.confirm()
+                stats['confirmed'] += 1
+                stats['updated'] += 1
+                logger.info(f"Pago {payment.pk} confirmado automáticamente")
+                
+            except Exception as e:
+                logger.exception(f"Error al actualizar pago {payment.pk}: {str(e)}")
+                stats['errors'] += 1
+    
+    if skipped:
+        logger.warning(f"Se omitió la consulta de {skipped} pagos pendientes porque la API de Recurrente no responde")
+    
+    # Guardar la información de los pagos no pagados con un solo UPDATE por lote.
+    # Las consultas a la API pueden tardar decenas de segundos: la info se relee bajo
+    # bloqueo para no pisar lo que haya escrito un webhook entretanto, y se omiten
+    # los pagos que ya no están pendientes
+    if to_save:
+        checkout_by_pk = dict(to_save)
+        with transaction.atomic():
+            locked = list(OrderPayment.objects.select_for_update().filter(
+                pk__in=checkout_by_pk,
+                state__in=(OrderPayment.PAYMENT_STATE_PENDING, OrderPayment.PAYMENT_STATE_CREATED),
+            ).only('pk', 'info'))
+            for payment in locked:
+                info = payment.info_data
+                info.update(_checkout_info_updates(info, checkout_by_pk[payment.pk], now_iso))
+                payment.info_data = info
+            OrderPayment.objects.bulk_update(locked, ['info'], batch_size=200)
+        stats['updated'] += len(locked)
+        if len(locked) < len(checkout_by_pk):
+            logger.info(f"{len(checkout_by_pk) - len(locked)} pagos cambiaron de estado durante el barrido y no se actualizaron")
     
     return stats 
 
+def _checkout_info_updates(info, checkout_data, now_iso):
+    """
+    Campos de info_data que el barrido actualiza a partir de la respuesta del checkout.
+    
+    Args:
+        info: info_data actual del pago (para conservar los valores que no vengan)
+        checkout_data: Respuesta de la API de Recurrente para el checkout
+        now_iso: Marca de tiempo del barrido
+        
+    Returns:
+        dict: Campos a aplicar sobre info_data
+    """
+    updates = {
+        'status': checkout_data.get('status', info.get('status')),
+        'created_at': checkout_data.get('created_at', info.get('created_at')),
+        'expires_at': checkout_data.get('expires_at', info.get('expires_at')),
+        'last_updated': now_iso,
+        'payment_id': checkout_data.get('payment', {}).get('id', info.get('payment_id')),
+        'auto_updated': True
+    }
+    
+    # Registrar campos adicionales
+    updates.update({
+        f'api_{key}': value
+        for key, value in checkout_data.items()
+        if key not in _CHECKOUT_EXCLUDED_KEYS
+    })
+    return updates
+
+# Rutas donde los webhooks de Recurrente pueden traer los metadatos del pedido,
+# en orden de búsqueda
+_METADATA_PATHS = (('checkout', 'metadata'), ('metadata',), ('data', 'metadata'))
+
+# Ruta conocida de los metadatos según el tipo de evento, para evitar recorrer todas
+_METADATA_PATH_BY_EVENT = {
+    'payment_intent.succeeded': ('checkout', 'metadata'),
+    'payment_intent.failed': ('checkout', 'metadata'),
+    'payment_intent.canceled': ('checkout', 'metadata'),
+    'payment_intent.payment_failed': ('checkout', 'metadata'),
+    'checkout.completed': ('metadata',),
+    'checkout.expired': ('metadata',),
+    'payment.failed': ('checkout', 'metadata'),
+}
+
+def _get_path(payload, path):
+    """Devuelve el valor en la ruta de claves indicada, o None si no existe"""
+    node = payload
+    for key in path:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node
+
+def _as_dict(value):
+    """Devuelve el valor si es un dict, o un dict vacío en cualquier otro caso"""
+    return value if isinstance(value, dict) else {}
+
+def _first_item(value):
+    """Devuelve el primer elemento si el valor es una lista no vacía, o None"""
+    return value[0] if isinstance(value, list) and value else None
+
+def find_webhook_metadata(payload):
+    """
+    Obtiene los metadatos del pedido de un webhook de Recurrente.
+
+    Prueba primero la ruta conocida para el tipo de evento y solo si ahí no hay
+    metadatos recorre el resto de rutas posibles.
+
+    Args:
+        payload: El payload completo del webhook
+
+    Returns:
+        dict: Los metadatos encontrados o un diccionario vacío
+    """
+    preferred = _METADATA_PATH_BY_EVENT.get(payload.get('event_type'))
+    if preferred:
+        metadata = _get_path(payload, preferred)
+        if metadata and isinstance(metadata, dict):
+            return metadata
+    for path in _METADATA_PATHS:
+        if path == preferred:
+            continue
+        metadata = _get_path(payload, path)
+        if metadata and isinstance(metadata, dict):
+            return metadata
+    return {}
+
 def extract_recurrente_data(webhook_data):
     """
     Extrae datos estructurados de un webhook de Recurrente.
@@ -219,23 +585,17 @@ def extract_recurrente_data(webhook_data):
         event_type = webhook_data.get('event_type')
         extracted_data['event_type'] = event_type
         
-        # IDs externos de pago y checkout
-        checkout = webhook_data.get('checkout', {})
-        payment_obj = webhook_data.get('payment', {})
+        # Normalizar una sola vez los objetos anidados: a partir de aquí son siempre dicts
+        checkout = _as_dict(webhook_data.get('checkout'))
+        payment_obj = _as_dict(webhook_data.get('payment'))
         
         # ID del checkout
-        checkout_id = checkout.get('id') if isinstance(checkout, dict) else None
+        checkout_id = checkout.get('id')
         extracted_data['external_checkout_id'] = checkout_id
         
         # ID del pago
         # Puede estar en diferentes rutas según la estructura
-        payment_id = None
-        if isinstance(payment_obj, dict) and 'id' in payment_obj:
-            payment_id = payment_obj.get('id')
-        elif checkout and isinstance(checkout, dict) and 'payment' in checkout:
-            checkout_payment = checkout.get('payment', {})
-            if isinstance(checkout_payment, dict) and 'id' in checkout_payment:
-                payment_id = checkout_payment.get('id')
+        payment_id = payment_obj.get('id') or _get_path(checkout, ('payment', 'id'))
         
         if not payment_id and 'id' in webhook_data:
             # Algunos webhooks tienen el ID de pago en la raíz
@@ -245,13 +605,9 @@ def extract_recurrente_data(webhook_data):
         
         # Datos del pedido en Pretix
         # Pueden estar en diferentes rutas según la estructura
-        metadata = None
-        if checkout and isinstance(checkout, dict) and 'metadata' in checkout:
-            metadata = checkout.get('metadata', {})
-        elif 'metadata' in webhook_data:
-            metadata = webhook_data.get('metadata', {})
+        metadata = find_webhook_metadata(webhook_data)
         
-        if metadata and isinstance(metadata, dict):
+        if metadata:
             # Extraer datos importantes del pedido
             extracted_data['order_code'] = metadata.get('order_code')
             extracted_data['payment_id_pretix'] = metadata.get('payment_id')
@@ -263,9 +619,7 @@ def extract_recurrente_data(webhook_data):
         extracted_data['currency'] = webhook_data.get('currency')
         
         # Estado del pago
-        status_checkout = None
-        if checkout and isinstance(checkout, dict):
-            status_checkout = checkout.get('status')
+        status_checkout = checkout.get('status')
         
         # Calcular estado según el tipo de evento y otros datos
         calculated_status = None
@@ -275,7 +629,7 @@ def extract_recurrente_data(webhook_data):
             calculated_status = 'failed'
         
         # Logging para depuración
-        logger.info(f"extract_recurrente_data DEBUG: event_type='{event_type}', status_checkout='{status_checkout}', calculated_status_recurrente='{calculated_status}'")
+        logger.debug("extract_recurrente_data: event_type='%s', status_checkout='%s', calculated_status_recurrente='%s'", event_type, status_checkout, calculated_status)
         
         # Prioridad: estado calculado > estado del checkout > algún otro estado
         extracted_data['status_recurrente'] = calculated_status or status_checkout or webhook_data.get('status')
@@ -284,24 +638,18 @@ def extract_recurrente_data(webhook_data):
         extracted_data['created_at_recurrente'] = webhook_data.get('created_at')
         
         # Método de pago
-        payment_method = None
-        if checkout and isinstance(checkout, dict):
-            payment_method = checkout.get('payment_method')
-        
-        extracted_data['payment_method_type'] = payment_method or webhook_data.get('payment_method')
+        extracted_data['payment_method_type'] = checkout.get('payment_method') or webhook_data.get('payment_method')
         
         # Información de la tarjeta (si está disponible)
-        if payment_obj and isinstance(payment_obj, dict) and 'card' in payment_obj:
-            card = payment_obj.get('card', {})
-            if isinstance(card, dict):
-                extracted_data['card_last4'] = card.get('last4')
-                extracted_data['card_network'] = card.get('network')
+        card = payment_obj.get('card')
+        if isinstance(card, dict):
+            extracted_data['card_last4'] = card.get('last4')
+            extracted_data['card_network'] = card.get('network')
         
         # Información del cliente
-        customer = webhook_data.get('customer', {})
-        if isinstance(customer, dict):
-            extracted_data['customer_email'] = customer.get('email')
-            extracted_data['customer_name'] = customer.get('full_name')
+        customer = _as_dict(webhook_data.get('customer'))
+        extracted_data['customer_email'] = customer.get('email')
+        extracted_data['customer_name'] = customer.get('full_name')
         
         # Motivo de fallo (si corresponde)
         extracted_data['failure_reason'] = webhook_data.get('failure_reason')
@@ -320,27 +668,25 @@ def extract_recurrente_data(webhook_data):
             extracted_data['vat_withheld_currency'] = webhook_data.get('vat_withheld_currency')
         
         # 2. Extraer datos de productos
-        if 'products' in webhook_data and isinstance(webhook_data['products'], list) and webhook_data['products']:
-            product = webhook_data['products'][0]  # Tomar el primer producto
-            if isinstance(product, dict):
-                extracted_data['product_name'] = product.get('name')
-                extracted_data['product_description'] = product.get('description')
-                # Extraer precios
-                if 'prices' in product and isinstance(product['prices'], list) and product['prices']:
-                    price = product['prices'][0]
-                    if isinstance(price, dict):
-                        extracted_data['product_price'] = price.get('amount_in_cents')
-                        extracted_data['product_currency'] = price.get('currency')
+        product = _first_item(webhook_data.get('products'))  # Tomar el primer producto
+        if isinstance(product, dict):
+            extracted_data['product_name'] = product.get('name')
+            extracted_data['product_description'] = product.get('description')
+            # Extraer precios
+            price = _first_item(product.get('prices'))
+            if isinstance(price, dict):
+                extracted_data['product_price'] = price.get('amount_in_cents')
+                extracted_data['product_currency'] = price.get('currency')
             
         # 3. Extraer datos adicionales de pago
-        if payment_obj and isinstance(payment_obj, dict):
-            paymentable = payment_obj.get('paymentable', {})
+        if payment_obj:
+            paymentable = payment_obj.get('paymentable')
             if isinstance(paymentable, dict):
                 extracted_data['payment_type'] = paymentable.get('type')
                 if paymentable.get('tax_id'):
-                    extracted_data['tax_id'] = paymentable.get('tax_id')
+                    extracted_data['tax_id'] = paymentable['tax_id']
                 if paymentable.get('tax_name'):
-                    extracted_data['tax_name'] = paymentable.get('tax_name')
+                    extracted_data['tax_name'] = paymentable['tax_name']
         
         # 4. Formatear campos para mostrar
         if extracted_data.get('amount_in_cents'):
@@ -355,57 +701,42 @@ def extract_recurrente_data(webhook_data):
         # 6. Formatear fecha de creación
         if extracted_data.get('created_at_recurrente'):
             try:
-                from datetime import datetime
-                # Parsear la fecha de varios formatos posibles
-                date_formats = [
-                    "%Y-%m-%dT%H:%M:%S.%f%z",
-                    "%Y-%m-%dT%H:%M:%S%z",
-                    "%Y-%m-%dT%H:%M:%S"
-                ]
-                
-                date_str = extracted_data['created_at_recurrente']
-                parsed_date = None
-                
-                for fmt in date_formats:
-                    try:
-                        parsed_date = datetime.strptime(date_str, fmt)
-                        break
-                    except (ValueError, TypeError):
-                        continue
-                
-                if parsed_date:
-                    extracted_data['formatted_date'] = parsed_date.strftime("%d/%m/%Y %H:%M")
+                # Si la fecha tiene un formato no reconocido se omite formatted_date
+                formatted_date = format_date(extracted_data['created_at_recurrente'], default=None)
+                if formatted_date:
+                    extracted_data['formatted_date'] = formatted_date
             except Exception as e:
                 logger.warning(f"Error al formatear fecha: {str(e)}")
         
-        # Logging para depuración
-        logger.info(f"Datos extraídos finales por extract_recurrente_data: {extracted_data}")
+        # Logging para depuración (el dict completo solo se formatea si DEBUG está activo)
+        logger.debug("Datos extraídos finales por extract_recurrente_data: %s", extracted_data)
         
         return extracted_data
     except Exception as e:
         logger.exception(f"Error al extraer datos de webhook Recurrente: {str(e)}")
         return {}
-    
-    result = {
-        'external_checkout_id': external_checkout_id,
-        'order_code': order_code,
-        'payment_id_pretix': payment_id_pretix,
-        'event_slug': event_slug,
-        'organizer_slug': organizer_slug,
-        'amount_in_cents': amount_in_cents,
-        'currency': currency,
-        'status_recurrente': calculated_status_recurrente,
-        'created_at_recurrente': created_at_recurrente,
-        'payment_method_type': payment_method_type,
-        'card_last4': card_last4,
-        'card_network': card_network,
-        'customer_email': customer_email,
-        'customer_name': customer_name,
-        'failure_reason': failure_reason
-    }
-    
-    logger.info(f"Datos extraídos finales por extract_recurrente_data: {result}")
-    return result
+
+def payload_fingerprint(payload):
+    """
+    Calcula una huella estable (independiente del orden de las claves) de un payload JSON.
+
+    Serializa con ``orjson`` si está instalado y usa BLAKE2b de 64 bits, más
+    rápido que MD5 y suficiente para deduplicar webhooks durante 24 horas.
+
+    Args:
+        payload: Diccionario serializable a JSON
+
+    Returns:
+        str: Huella hexadecimal de 16 caracteres
+    """
+    if orjson is not None:
+        data = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    else:
+        data = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+# Rutas donde puede venir el identificador del webhook, en orden de preferencia
+_WEBHOOK_ID_PATHS = (('id',), ('payment', 'id'), ('data', 'id'), ('checkout', 'id'))
 
 def is_webhook_already_processed(payload):
     """
@@ -417,37 +748,20 @@ def is_webhook_already_processed(payload):
     Returns:
         bool: True si ya fue procesado, False en caso contrario
     """
-    from django.core.cache import cache
-    
     # Intentar obtener un ID único para el webhook
     webhook_id = None
     event_type = payload.get('event_type', payload.get('type', 'unknown'))
     
     # Intentar obtener el ID del pago como identificador único
-    if 'id' in payload:
-        webhook_id = payload['id']
-    elif 'payment' in payload and isinstance(payload['payment'], dict) and 'id' in payload['payment']:
-        webhook_id = payload['payment']['id']
-    elif 'data' in payload and isinstance(payload['data'], dict) and 'id' in payload['data']:
-        webhook_id = payload['data']['id']
-    elif 'checkout' in payload and isinstance(payload['checkout'], dict):
-        webhook_id = payload['checkout'].get('id')
+    for path in _WEBHOOK_ID_PATHS:
+        webhook_id = _get_path(payload, path)
+        if webhook_id:
+            break
     
     # Si no hay ID, intentar usar una combinación de otros campos
     if not webhook_id:
         # Datos que deberían estar en la mayoría de webhooks
-        metadata = {}
-        for path in [['checkout', 'metadata'], ['metadata'], ['data', 'metadata']]:
-            current = payload
-            for key in path:
-                if isinstance(current, dict) and key in current:
-                    current = current[key]
-                else:
-                    current = None
-                    break
-            if current:
-                metadata = current
-                break
+        metadata = find_webhook_metadata(payload)
         
         order_code = metadata.get('order_code')
         payment_id = metadata.get('payment_id')
@@ -457,10 +771,7 @@ def is_webhook_already_processed(payload):
     
     # Si aún no hay ID, usar un hash de todo el payload como último recurso
     if not webhook_id:
-        import hashlib
-        import json
-        payload_str = json.dumps(payload, sort_keys=True)
-        webhook_id = hashlib.md5(payload_str.encode()).hexdigest()
+        webhook_id = payload_fingerprint(payload)
     
     # Si no hay ID después de todo, no podemos verificar
     if not webhook_id:
@@ -470,31 +781,100 @@ def is_webhook_already_processed(payload):
     # Clave única para este webhook
     cache_key = f"recurrente_webhook_processed_{webhook_id}_{event_type}"
     
-    # Verificar si ya existe en la cache
-    if cache.get(cache_key):
+    # Marcar como procesado por 24 horas; cache.add es atómico y solo guarda la
+    # clave si no existía, así que dos webhooks idénticos simultáneos no pasan ambos
+    if not cache.add(cache_key, True, timeout=86400):  # 24 horas en segundos
         logger.info(f"Webhook con ID {webhook_id} ya fue procesado anteriormente")
         return True
-    
-    # Marcar como procesado por 24 horas
-    cache.set(cache_key, True, timeout=86400)  # 24 horas en segundos
     return False
 
-def safe_confirm_payment(payment, info=None, payment_id=None, logger=None):
+# Campos del payload del webhook que se conservan en info_data['webhook_data']
+_WEBHOOK_INFO_WHITELIST = frozenset({
+    'id', 'event_type', 'status', 'amount_in_cents', 'currency', 'created_at',
+    'fee', 'vat_withheld', 'customer', 'user_id', 'used_presaved_payment_method',
+})
+
+# Datos del comercio y del producto que se copian a info_data: para cada objeto
+# del payload, pares (subcampo, clave destino), en orden de prioridad. Ante varios
+# valores gana el primero de la tabla: el subcampo más específico dentro de cada
+# objeto (business_name sobre name) y, entre objetos, seller/payment sobre store
+_COMERCIO_KEYS = (('business_name', 'comercio_nombre'), ('name', 'comercio_nombre'))
+_PRODUCTO_KEYS = (
+    ('product_description', 'producto_descripcion'),
+    ('description', 'producto_descripcion'),
+    ('title', 'producto_titulo'),
+)
+_COMERCIO_PRODUCTO_FIELDS = (
+    ('seller', _COMERCIO_KEYS),
+    ('payment', _COMERCIO_KEYS + _PRODUCTO_KEYS),
+    ('description', _PRODUCTO_KEYS),
+    ('item', _PRODUCTO_KEYS),
+    ('product', _PRODUCTO_KEYS),
+    ('checkout', _COMERCIO_KEYS + _PRODUCTO_KEYS),
+    ('merchant', _COMERCIO_KEYS),
+    ('business', _COMERCIO_KEYS),
+    ('store', _COMERCIO_KEYS),
+)
+_COMERCIO_PRODUCTO_TARGET_COUNT = len({target for _, mapping in _COMERCIO_PRODUCTO_FIELDS for _, target in mapping})
+
+def _find_comercio_producto(info):
+    """
+    Busca en el payload el nombre del comercio y la descripción y título del producto.
+    
+    Args:
+        info: Payload del webhook o de la API (dict)
+        
+    Returns:
+        dict: Claves comercio_nombre, producto_descripcion y producto_titulo encontradas
+    """
+    # Gana el primer valor encontrado para cada clave destino
+    found = {}
+    for field, mapping in _COMERCIO_PRODUCTO_FIELDS:
+        nested = info.get(field)
+        if isinstance(nested, dict):
+            for subfield, target in mapping:
+                if target not in found and subfield in nested:
+                    found[target] = nested[subfield]
+            if len(found) == _COMERCIO_PRODUCTO_TARGET_COUNT:
+                break
+    return found
+
+# Campos del payload que pueden traer los datos del comprobante de Recurrente:
+# los básicos primero y después los que podrían estar en el payload
+_RECIBO_FIELDS = ('receipt_number', 'authorization_code', 'receipt', 'invoice', 'transaction', 'reference', 'payment')
+# Subcampos con el número de recibo y el código de autorización, en orden de preferencia
+_RECIBO_NUMBER_KEYS = ('number', 'id', 'receipt_number')
+_RECIBO_AUTH_KEYS = ('authorization', 'auth_code', 'code')
+
+# Indicadores que safe_confirm_payment agrega a info_data al confirmar
+_CONFIRMATION_FLAGS = {
+    'confirmed_by_webhook': True,
+    'confirmation_success': True,
+    'estado': 'Confirmado',
+}
+
+def safe_confirm_payment(payment, info=None, payment_id=None, logger=None, extra_info=None):
     """
     Función para confirmar pagos de manera segura evitando condiciones de carrera.
-    Implementa un mecanismo de bloqueo simple basado en cache.
+    La confirmación se serializa con un bloqueo de fila en la base de datos
+    (SELECT ... FOR UPDATE) sobre el pago.
     
     Args:
         payment: Objeto OrderPayment a confirmar
         info: Datos adicionales para agregar a info_data (opcional)
         payment_id: ID del pago en el sistema externo (opcional)
         logger: Logger para usar (opcional)
+        extra_info: Campos que se guardan tal cual en info_data junto con la confirmación (opcional)
         
     Returns:
         bool: True si se confirmó exitosamente, False en caso contrario
     """
     if logger is None:
         logger = logging.getLogger('pretix.plugins.recurrente')
+    
+    # Un payload que no es dict se trata como vacío: los bloques de extracción
+    # solo comprueban si hay datos
+    info = _as_dict(info)
         
     # Si el pago ya está confirmado, no hacer nada
     if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
@@ -510,22 +890,6 @@ def safe_confirm_payment(payment, info=None, payment_id=None, logger=None):
     # Obtener el pedido asociado al pago
     order = payment.order
     
-    # Clave única para este pago
-    lock_key = f"recurrente_payment_confirmation_lock_{payment.pk}"
-    # Adquirir un "lock" por 30 segundos
-    lock_acquired = cache.add(lock_key, "locked", timeout=30)
-    
-    if not lock_acquired:
-        logger.info(f"Otra operación está confirmando el pago {payment.pk}. Evitando procesamiento paralelo.")
-        # Esperar un momento para ver si el estado cambia
-        time.sleep(0.5)
-        # Verificar si mientras tanto ya se confirmó
-        payment.refresh_from_db()
-        if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
-            logger.info(f"El pago {payment.pk} ya fue confirmado mientras esperábamos.")
-            return True
-        return False
-    
     try:
         # Recargar el objeto para tener la versión más actualizada
         payment.refresh_from_db()
@@ -548,7 +912,7 @@ def safe_confirm_payment(payment, info=None, payment_id=None, logger=None):
         used_presaved_payment_method = None
         
         # Extraer información desde el payload recibido
-        if info and isinstance(info, dict):
+        if info:
             # Fecha de creación
             created_at = info.get('created_at')
             
@@ -577,44 +941,56 @@ def safe_confirm_payment(payment, info=None, payment_id=None, logger=None):
             
             # Intentar extraer datos desde posibles estructuras anidadas
             for field in ['receipt', 'payment', 'checkout', 'transaction']:
-                if field in info and isinstance(info[field], dict):
-                    receipt_number = receipt_number or info[field].get('receipt_number') or info[field].get('number')
-                    authorization_code = authorization_code or info[field].get('authorization_code')
-                    
-                    if 'authorization' in info[field] and isinstance(info[field]['authorization'], dict):
-                        authorization_code = authorization_code or info[field]['authorization'].get('code')
+                nested = info.get(field)
+                if isinstance(nested, dict):
+                    receipt_number = receipt_number or nested.get('receipt_number') or nested.get('number')
+                    authorization_code = (
+                        authorization_code
+                        or nested.get('authorization_code')
+                        or _get_path(nested, ('authorization', 'code'))
+                    )
                     
                     # Extraer cliente desde estructuras anidadas si está disponible
-                    if 'customer' in info[field] and isinstance(info[field]['customer'], dict):
-                        customer_name = customer_name or info[field]['customer'].get('full_name')
-                        customer_email = customer_email or info[field]['customer'].get('email')
+                    nested_customer = nested.get('customer')
+                    if isinstance(nested_customer, dict):
+                        customer_name = customer_name or nested_customer.get('full_name')
+                        customer_email = customer_email or nested_customer.get('email')
             
             # Información del método de pago
             if 'payment_method' in info:
-                payment_method = info.get('payment_method', {})
-                if isinstance(payment_method, dict) and payment_method.get('type') == 'card':
-                    card_info = payment_method.get('card', {})
-            elif 'checkout' in info and 'payment_method' in info['checkout']:
-                payment_method = info['checkout']['payment_method']
-                if isinstance(payment_method, dict) and payment_method.get('type') == 'card':
-                    card_info = payment_method.get('card', {})
-
-        # También buscar en las estructuras anidadas
-        if not created_at and info and isinstance(info, dict) and 'checkout' in info:
-            created_at = info['checkout'].get('created_at', created_at)
+                payment_method = info['payment_method']
+            else:
+                payment_method = _get_path(info, ('checkout', 'payment_method'))
+            if isinstance(payment_method, dict) and payment_method.get('type') == 'card':
+                card_info = payment_method.get('card', {})
+
+            # También buscar en las estructuras anidadas
+            created_at = created_at or _get_path(info, ('checkout', 'created_at'))
         
         # Extraer número de recibo desde el ID del pago si está disponible
         if not receipt_number and payment_id:
             receipt_number = f"{payment_id[-5:]}" if len(payment_id) > 5 else payment_id
                     
-        # Asegurarnos de que info_data sea un diccionario válido
-        if not isinstance(payment.info_data, dict):
+        # Trabajar sobre una copia local: payment.info_data decodifica el JSON en cada
+        # acceso y devuelve un dict nuevo, así que las modificaciones directas se perderían
+        info_data = payment.info_data
+        if not isinstance(info_data, dict):
             logger.warning(f"payment.info_data no es un diccionario válido para pago {payment.pk}, inicializando")
-            payment.info_data = {}
+            info_data = {}
+        
+        # Los campos del llamador se aplican sobre la info recargada: refresh_from_db
+        # descarta cualquier cambio hecho en memoria a payment.info_data
+        if extra_info:
+            info_data.update(extra_info)
+        
+        # Marca de tiempo única para toda la confirmación
+        now = datetime.now()
+        now_iso = now.isoformat()
+        now_fmt = now.strftime('%d/%m/%Y %H:%M')
         
         # Actualizar con datos básicos primero
-        payment.info_data.update({
-            'confirmed_at': datetime.now().isoformat(),
+        info_data.update({
+            'confirmed_at': now_iso,
             'estado': 'Confirmado',  # Campo visible en la interfaz
             'status': 'succeeded',
             'last_update_source': 'safe_confirm_payment'
@@ -624,156 +1000,151 @@ def safe_confirm_payment(payment, info=None, payment_id=None, logger=None):
         # Estos son los campos explícitamente usados en la plantilla:
         
         # Campos de estado y recibo
-        payment.info_data['receipt_number'] = receipt_number or payment.info_data.get('receipt_number', f"R{payment.pk}")
-        payment.info_data['authorization_code'] = authorization_code or payment.info_data.get('authorization_code')
+        info_data['receipt_number'] = receipt_number or info_data.get('receipt_number', f"R{payment.pk}")
+        info_data['authorization_code'] = authorization_code or info_data.get('authorization_code')
         
         # Campos de fecha (created se usa en la plantilla)
         if created_at:
-            payment.info_data['created_at'] = created_at
+            info_data['created_at'] = created_at
             try:
-                formatted_date = format_date(created_at)
-                payment.info_data['created'] = formatted_date if formatted_date != "No disponible" else datetime.now().strftime('%d/%m/%Y %H:%M')
+                info_data['created'] = format_date(created_at, default=None) or now_fmt
                 # Asegurarnos de que la fecha aparezca en la interfaz
-                payment.info_data['fecha'] = formatted_date if formatted_date != "No disponible" else datetime.now().strftime('%d/%m/%Y %H:%M')
+                info_data['fecha'] = info_data['created']
             except Exception as e:
                 logger.warning(f"Error al formatear fecha: {e}")
-                payment.info_data['created'] = datetime.now().strftime('%d/%m/%Y %H:%M')
-                payment.info_data['fecha'] = datetime.now().strftime('%d/%m/%Y %H:%M')
+                info_data['created'] = now_fmt
+                info_data['fecha'] = now_fmt
         else:
             # Si no hay fecha, crear una
-            current_date = datetime.now().strftime('%d/%m/%Y %H:%M')
-            payment.info_data['created'] = payment.info_data.get('created', current_date)
-            payment.info_data['fecha'] = current_date
+            info_data['created'] = info_data.get('created', now_fmt)
+            info_data['fecha'] = now_fmt
             
         # Para la plantilla de email se usa transaction_date
-        payment.info_data['transaction_date'] = payment.info_data.get('created')
+        info_data['transaction_date'] = info_data.get('created')
         
         # Campos del cliente
-        payment.info_data['customer_name'] = customer_name or payment.info_data.get('customer_name')
-        payment.info_data['customer_email'] = customer_email or payment.info_data.get('customer_email')
+        info_data['customer_name'] = customer_name or info_data.get('customer_name')
+        info_data['customer_email'] = customer_email or info_data.get('customer_email')
         
         # Método de pago
         if payment_method:
             if isinstance(payment_method, dict):
-                payment.info_data['payment_method'] = payment_method.get('type', 'card')
+                info_data['payment_method'] = payment_method.get('type', 'card')
                 
                 # Información de tarjeta si está disponible
                 if card_info and isinstance(card_info, dict):
-                    payment.info_data['card_last4'] = card_info.get('last4')
-                    payment.info_data['card_network'] = card_info.get('network')
+                    info_data['card_last4'] = card_info.get('last4')
+                    info_data['card_network'] = card_info.get('network')
             elif isinstance(payment_method, str):
-                payment.info_data['payment_method'] = payment_method
+                info_data['payment_method'] = payment_method
         else:
             # Asegurarnos de que haya un método de pago para la plantilla
-            payment.info_data['payment_method'] = payment.info_data.get('payment_method', 'card')
+            info_data['payment_method'] = info_data.get('payment_method', 'card')
             
         # Si se usó un método de pago guardado
         if used_presaved_payment_method is not None:
-            payment.info_data['used_presaved_payment_method'] = used_presaved_payment_method
+            info_data['used_presaved_payment_method'] = used_presaved_payment_method
             
         # Campos de monto (para plantilla email)
         if payment.amount:
-            payment.info_data['amount'] = float(payment.amount)
+            info_data['amount'] = float(payment.amount)
             
         # Agregar detalles de cantidad y moneda
         if amount_in_cents:
-            payment.info_data['amount_in_cents'] = amount_in_cents
+            info_data['amount_in_cents'] = amount_in_cents
             
         if currency:
-            payment.info_data['currency'] = currency
+            info_data['currency'] = currency
         
         # Agregar payment_id si se proporciona
         if payment_id:
-            payment.info_data['payment_id'] = payment_id
+            info_data['payment_id'] = payment_id
         
         # Extraer información sobre el comercio (nombre y descripción del producto)
         # Esta información aparece en el comprobante de Recurrente
-        if info and isinstance(info, dict):
-            # Intentar extraer nombre del comercio
-            for field in ['store', 'business', 'merchant', 'checkout', 'payment', 'seller']:
-                if field in info and isinstance(info[field], dict):
-                    if 'name' in info[field]:
-                        payment.info_data['comercio_nombre'] = info[field]['name']
-                    if 'business_name' in info[field]:
-                        payment.info_data['comercio_nombre'] = info[field]['business_name']
-            
-            # Intentar extraer descripción del producto
-            for field in ['checkout', 'product', 'item', 'description', 'payment']:
-                if field in info and isinstance(info[field], dict):
-                    if 'description' in info[field]:
-                        payment.info_data['producto_descripcion'] = info[field]['description']
-                    if 'product_description' in info[field]:
-                        payment.info_data['producto_descripcion'] = info[field]['product_description']
-                    if 'title' in info[field]:
-                        payment.info_data['producto_titulo'] = info[field]['title']
+        if info:
+            info_data.update(_find_comercio_producto(info))
                 
         # Guardar toda la información relacionada con el recibo que vimos en las imágenes
-        if info and isinstance(info, dict):
+        if info:
             # Buscar esos campos específicos que aparecen en el comprobante de Recurrente
-            recibo_fields = [
-                # Campos básicos
-                'receipt_number', 'authorization_code', 
-                # Campos adicionales que podrían estar en el payload
-                'receipt', 'invoice', 'transaction', 'reference', 'payment'
-            ]
-            
-            for field in recibo_fields:
-                if field in info:
-                    if isinstance(info[field], dict):
-                        # Si es un diccionario, extraer campos principales
-                        for subfield in ['number', 'id', 'receipt_number', 'authorization', 'auth_code', 'code']:
-                            if subfield in info[field]:
-                                if subfield in ['number', 'receipt_number', 'id'] and not payment.info_data.get('numero_recibo'):
-                                    payment.info_data['numero_recibo'] = info[field][subfield]
-                                    payment.info_data['recibo'] = f"#{info[field][subfield]}"
-                                elif subfield in ['authorization', 'auth_code', 'code'] and not payment.info_data.get('codigo_autorizacion'):
-                                    payment.info_data['codigo_autorizacion'] = info[field][subfield]
-                                    payment.info_data['autorizacion'] = info[field][subfield]
-                    elif isinstance(info[field], str) and field == 'receipt_number':
-                        payment.info_data['numero_recibo'] = info[field]
-                        payment.info_data['recibo'] = f"#{info[field]}"
-                    elif isinstance(info[field], str) and field == 'authorization_code':
-                        payment.info_data['codigo_autorizacion'] = info[field]
-                        payment.info_data['autorizacion'] = info[field]
+            for field in _RECIBO_FIELDS:
+                if field not in info:
+                    continue
+                value = info[field]
+                if isinstance(value, dict):
+                    # Si es un diccionario, extraer campos principales (gana el primero encontrado)
+                    for subfield in _RECIBO_NUMBER_KEYS:
+                        if subfield in value and not info_data.get('numero_recibo'):
+                            info_data['numero_recibo'] = value[subfield]
+                            info_data['recibo'] = f"#{value[subfield]}"
+                    for subfield in _RECIBO_AUTH_KEYS:
+                        if subfield in value and not info_data.get('codigo_autorizacion'):
+                            info_data['codigo_autorizacion'] = value[subfield]
+                            info_data['autorizacion'] = value[subfield]
+                elif isinstance(value, str) and field == 'receipt_number':
+                    info_data['numero_recibo'] = value
+                    info_data['recibo'] = f"#{value}"
+                elif isinstance(value, str) and field == 'authorization_code':
+                    info_data['codigo_autorizacion'] = value
+                    info_data['autorizacion'] = value
             
             # Extraer datos importantes
             for key in ['customer', 'user_id', 'used_presaved_payment_method']:
                 if key in info:
-                    payment.info_data[key] = info[key]
+                    info_data[key] = info[key]
             
             # Si hay full_webhook_payload, guardarlo en un campo especial
             if 'full_webhook_payload' in info:
-                payment.info_data['full_webhook_payload'] = info['full_webhook_payload']
+                info_data['full_webhook_payload'] = info['full_webhook_payload']
             elif info.get('webhook_data') is None:
-                # Limpiar info para la traza completa (evitar objetos no serializables o demasiado grandes)
-                clean_info = {}
-                for key, value in info.items():
-                    if isinstance(value, (str, int, float, bool, type(None))):
-                        clean_info[key] = value
-                    elif isinstance(value, dict):
-                        # Solo incluir el primer nivel de diccionarios
-                        clean_info[key] = {k: v for k, v in value.items() 
-                                         if isinstance(v, (str, int, float, bool, type(None)))}
-                    elif isinstance(value, list) and len(value) < 10:
-                        # Solo incluir listas pequeñas
-                        clean_info[key] = value[:10]
-                        
-                payment.info_data['webhook_data'] = clean_info
+                # Guardar solo los campos conocidos del webhook para la traza (evita copiar
+                # y recorrer el payload completo, y mantiene pequeño info_data)
+                clean_info = {key: info[key] for key in _WEBHOOK_INFO_WHITELIST if key in info}
+                info_data['webhook_data'] = clean_info
+        
+        # Indicadores para que las vistas puedan verificar fácilmente el estado. Se
+        # agregan antes de confirmar porque la info se guarda en la misma escritura
+        # que el estado; si la confirmación falla se quitan (ver el except)
+        info_data.update(_CONFIRMATION_FLAGS)
+        info_data['confirmed_at_webhook'] = now_iso
         
-        # Guardar los cambios en info_data antes de confirmar
+        # Codificar fuera de la transacción: la confirmación no depende de que se
+        # pueda guardar la info
         try:
-            payment.info = json.dumps(payment.info_data)
-            payment.save(update_fields=['info'])
-            logger.info(f"Información de pago actualizada correctamente para pago {payment.pk}")
-        except Exception as e:
-            logger.error(f"Error al guardar la información del pago {payment.pk}: {str(e)}")
-            # Continuamos con la confirmación aunque haya fallado la actualización de info
+            encoded_info = json_dumps(info_data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Error al codificar la información de confirmación para pago {payment.pk}: {str(e)}")
+            encoded_info = None
         
         # Intentar confirmar
         try:
             with transaction.atomic():
                 with scopes_disabled():
+                    # Bloquear la fila del pago: las confirmaciones concurrentes del mismo
+                    # pago esperan en la base de datos y, al obtener el bloqueo, ven el
+                    # estado ya actualizado por la primera
+                    locked = OrderPayment.objects.select_for_update().filter(
+                        pk=payment.pk
+                    ).only('pk', 'state').first()
+                    if locked is None:
+                        logger.warning(f"El pago {payment.pk} ya no existe. No se confirma.")
+                        return False
+                    if locked.state not in [OrderPayment.PAYMENT_STATE_PENDING, OrderPayment.PAYMENT_STATE_CREATED]:
+                        # Quien cambió el estado ya guardó su propia info; no se mezcla con la de esta llamada
+                        logger.info(f"El pago {payment.pk} cambió de estado a {locked.state} antes de confirmarse. No se guardan los datos del recibo de esta confirmación.")
+                        return locked.state == OrderPayment.PAYMENT_STATE_CONFIRMED
+                    # confirm() copia payment.info a la fila y la guarda junto con el estado:
+                    # una sola escritura, y el correo y las señales de pedido pagado ya ven
+                    # los datos del recibo, la tarjeta y el cliente
+                    if encoded_info is not None:
+                        payment.info = encoded_info
                     payment.confirm()
+            
+            # El registro de auditoría va fuera de la transacción para no alargar el bloqueo;
+            # si falla, el pago ya está confirmado y no debe tratarse como error de confirmación
+            try:
+                with scopes_disabled():
                     order.log_action(
                         'pretix.plugins.recurrente.payment.confirmed',
                         data={
@@ -782,46 +1153,31 @@ def safe_confirm_payment(payment, info=None, payment_id=None, logger=None):
                             'info': f"Pago confirmado a través de Recurrente (ID: {payment_id})"
                         }
                     )
+            except Exception as e:
+                logger.error(f"Error al registrar la confirmación del pago {payment.pk}: {str(e)}")
             logger.info(f"Pago {payment.pk} confirmado exitosamente para pedido {order.code}")
             
-            # Actualizar info_data con indicadores adicionales para que las vistas puedan verificar fácilmente el estado
-            payment.refresh_from_db()
-            if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
-                try:
-                    payment.info_data.update({
-                        'confirmed_by_webhook': True,
-                        'confirmed_at_webhook': datetime.now().isoformat(),
-                        'confirmation_success': True
-                    })
-                    
-                    # Garantizar que el estado sea visible en la interfaz
-                    if 'estado' not in payment.info_data or payment.info_data.get('estado') != 'Confirmado':
-                        payment.info_data['estado'] = 'Confirmado'
-                    
-                    payment.info = json.dumps(payment.info_data)
-                    payment.save(update_fields=['info'])
-                    logger.info(f"Información de confirmación actualizada para pago {payment.pk}")
-                    return True
-                except Exception as e:
-                    logger.error(f"Error al actualizar la información de confirmación para pago {payment.pk}: {str(e)}")
-                    # La confirmación fue exitosa aunque no pudimos actualizar la info
-                    return True
-            else:
+            # confirm() asigna el estado en el objeto en memoria: no hace falta recargarlo
+            if payment.state != OrderPayment.PAYMENT_STATE_CONFIRMED:
                 logger.error(f"El pago {payment.pk} no está en estado confirmado después de llamar a payment.confirm()")
                 return False
+            return True
                 
         except Exception as e:
             logger.error(f"Error al confirmar pago {payment.pk}: {str(e)}")
             
-            # Actualizar info con el error
+            # Guardar los datos del recibo junto con el error
             try:
                 payment.refresh_from_db()
-                payment.info_data.update({
+                for key in _CONFIRMATION_FLAGS:
+                    info_data.pop(key, None)
+                info_data.pop('confirmed_at_webhook', None)
+                info_data.update({
                     'confirmation_error': str(e),
-                    'confirmation_error_time': datetime.now().isoformat(),
+                    'confirmation_error_time': now_iso,
                     'estado': 'Error en confirmación'
                 })
-                payment.info = json.dumps(payment.info_data)
+                payment.info = json_dumps(info_data)
                 payment.save(update_fields=['info'])
             except Exception as update_error:
                 logger.error(f"Error al actualizar info con el error de confirmación: {str(update_error)}")
@@ -831,14 +1187,20 @@ def safe_confirm_payment(payment, info=None, payment_id=None, logger=None):
     except Exception as e:
         logger.exception(f"Error inesperado al procesar confirmación de pago {payment.pk}: {str(e)}")
         return False
-    finally:
-        # Asegurarnos de liberar el lock incluso si hay excepciones
-        cache.delete(lock_key)
+
+# Tiempo (segundos) que se reutilizan los detalles de un pago ya consultado
+_PAYMENT_DETAILS_CACHE_TIMEOUT = 30
+# Estados que todavía pueden cambiar en segundos: no se cachean para no retrasar
+# la detección de un pago completado
+_PAYMENT_DETAILS_UNCACHED_STATUSES = frozenset({'pending', 'created'})
 
 def get_payment_details_from_recurrente(api_key, api_secret, payment_id=None, checkout_id=None, ignore_ssl=False):
     """
     Consulta los detalles completos de un pago en Recurrente y extrae la información relevante
     
+    Los resultados se reutilizan durante unos segundos para que los reintentos de
+    webhooks y las consultas de estado repetidas no vuelvan a llamar a la API.
+    
     Args:
         api_key: Clave pública de API
         api_secret: Clave secreta de API
@@ -854,6 +1216,22 @@ def get_payment_details_from_recurrente(api_key, api_secret, payment_id=None, ch
         logger.warning("Se necesita al menos un payment_id o checkout_id para consultar detalles")
         return {}
     
+    # La clave incluye las credenciales solo como hash, nunca en claro
+    key_material = f"{api_key}\0{api_secret}\0{payment_id}\0{checkout_id}".encode()
+    cache_key = 'recurrente_payment_details_' + hashlib.blake2b(key_material, digest_size=16).hexdigest()
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    result = _fetch_payment_details(api_key, api_secret, payment_id, checkout_id, ignore_ssl)
+    
+    # No se cachean los errores (dict vacío) ni los pagos aún pendientes
+    if result and result.get('status') not in _PAYMENT_DETAILS_UNCACHED_STATUSES:
+        cache.set(cache_key, result, _PAYMENT_DETAILS_CACHE_TIMEOUT)
+    return result
+
+def _fetch_payment_details(api_key, api_secret, payment_id, checkout_id, ignore_ssl):
+    """Hace las consultas a la API para get_payment_details_from_recurrente"""
     # Preparar headers para la API
     headers = {
         'Content-Type': 'application/json',
@@ -864,22 +1242,25 @@ def get_payment_details_from_recurrente(api_key, api_secret, payment_id=None, ch
     # Construir URL base de la API
     base_url = "https://app.recurrente.com/api"
     
+    def fetch(url):
+        return http_session.get(
+            url,
+            headers=headers,
+            timeout=10,
+            verify=not ignore_ssl
+        )
+    
     try:
         # Intentar consultar por checkout_id primero si está disponible
         if checkout_id:
             checkout_url = f"{base_url}/checkouts/{checkout_id}"
             logger.info(f"Consultando checkout por ID: {checkout_url}")
             
-            response = requests.get(
-                checkout_url,
-                headers=headers,
-                timeout=10,
-                verify=not ignore_ssl
-            )
+            response = fetch(checkout_url)
             
             if response.status_code < 400:
                 checkout_data = safe_json_parse(response)
-                logger.info(f"Datos de checkout obtenidos: {checkout_data}")
+                logger.debug("Datos de checkout obtenidos: %s", checkout_data)
                 
                 # Extraer payment_id si está disponible en el checkout
                 if not payment_id and 'payment' in checkout_data and isinstance(checkout_data['payment'], dict):
@@ -888,17 +1269,11 @@ def get_payment_details_from_recurrente(api_key, api_secret, payment_id=None, ch
                 
                 # Si tenemos un payment_id, consultar detalles del pago
                 if payment_id:
-                    payment_url = f"{base_url}/payments/{payment_id}"
-                    payment_response = requests.get(
-                        payment_url,
-                        headers=headers,
-                        timeout=10,
-                        verify=not ignore_ssl
-                    )
+                    payment_response = fetch(f"{base_url}/payments/{payment_id}")
                     
                     if payment_response.status_code < 400:
                         payment_data = safe_json_parse(payment_response)
-                        logger.info(f"Datos de pago obtenidos: {payment_data}")
+                        logger.debug("Datos de pago obtenidos: %s", payment_data)
                         
                         # Extraer información relevante
                         receipt_info = {}
@@ -946,16 +1321,11 @@ def get_payment_details_from_recurrente(api_key, api_secret, payment_id=None, ch
             payment_url = f"{base_url}/payments/{payment_id}"
             logger.info(f"Consultando pago por ID: {payment_url}")
             
-            payment_response = requests.get(
-                payment_url,
-                headers=headers,
-                timeout=10,
-                verify=not ignore_ssl
-            )
+            payment_response = fetch(payment_url)
             
             if payment_response.status_code < 400:
                 payment_data = safe_json_parse(payment_response)
-                logger.info(f"Datos de pago obtenidos: {payment_data}")
+                logger.debug("Datos de pago obtenidos: %s", payment_data)
                 return payment_data
     
     except Exception as e:
@@ -963,6 +1333,15 @@ def get_payment_details_from_recurrente(api_key, api_secret, payment_id=None, ch
     
     return {}
 
+# Patrones para extraer el ID de checkout, en orden de preferencia
+_CHECKOUT_ID_PATTERNS = (
+    re.compile(r'checkout-session[/=]([a-zA-Z0-9_]+)'),  # formato: checkout-session/ch_xxxx
+    re.compile(r'checkout[/=]([a-zA-Z0-9_]+)'),          # formato: checkout/ch_xxxx
+    re.compile(r'ch_([a-zA-Z0-9_]+)'),                   # formato: ch_xxxx en cualquier parte
+    re.compile(r'checkout_([a-zA-Z0-9_]+)'),             # formato: checkout_xxxx
+    re.compile(r'/c/([a-zA-Z0-9_]+)'),                   # formato: /c/xxxx (URL corta)
+)
+
 def extract_checkout_id_from_url(checkout_url):
     """
     Extrae el ID de checkout a partir de una URL de Recurrente
@@ -977,17 +1356,8 @@ def extract_checkout_id_from_url(checkout_url):
         return None
         
     try:
-        # Patrones para extraer el ID de checkout
-        patterns = [
-            r'checkout-session[/=]([a-zA-Z0-9_]+)',  # formato: checkout-session/ch_xxxx
-            r'checkout[/=]([a-zA-Z0-9_]+)',          # formato: checkout/ch_xxxx
-            r'ch_([a-zA-Z0-9_]+)',                  # formato: ch_xxxx en cualquier parte
-            r'checkout_([a-zA-Z0-9_]+)',            # formato: checkout_xxxx
-            r'/c/([a-zA-Z0-9_]+)',                  # formato: /c/xxxx (URL corta)
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, checkout_url)
+        for pattern in _CHECKOUT_ID_PATTERNS:
+            match = pattern.search(checkout_url)
             if match:
                 # Si el patrón no incluye el prefijo 'ch_', agregarlo
                 checkout_id = match.group(1)
@@ -995,9 +1365,13 @@ def extract_checkout_id_from_url(checkout_url):
                     checkout_id = f"ch_{checkout_id}"
                 return checkout_id
         
-        # Última opción: extraer la última parte de la URL
-        path = urllib.parse.urlparse(checkout_url).path
-        last_part = path.rstrip('/').split('/')[-1]
+        # Última opción: extraer la última parte de la ruta de la URL. Se hace con
+        # operaciones de texto (sin fragmento, query, esquema ni host), que dan el
+        # mismo resultado que urllib.parse.urlparse sin construir el ParseResult
+        path = checkout_url.partition('#')[0].partition('?')[0]
+        if '://' in path:
+            path = path.partition('://')[2].partition('/')[2]
+        last_part = path.rstrip('/').rpartition('/')[2].partition(';')[0]
         if last_part and len(last_part) > 4:  # Asegurarse de que no sea una palabra común
             if not last_part.startswith('ch_'):
                 last_part = f"ch_{last_part}"
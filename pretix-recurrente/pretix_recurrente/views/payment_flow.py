@@ -20,9 +20,26 @@ import time
 from pretix.base.models import Order, OrderPayment
 from pretix.multidomain.urlreverse import eventreverse, build_absolute_uri
 
+from pretix_recurrente.utils import safe_json_parse, safe_confirm_payment
+
 logger = logging.getLogger('pretix.plugins.recurrente')
 
 
+def _find_payment_by_checkout_id(event, checkout_id):
+    """
+    Busca el pago más reciente de Recurrente del evento que contiene el checkout_id.
+    
+    Raises:
+        OrderPayment.DoesNotExist: Si no hay ningún pago con ese checkout_id
+    """
+    # El pedido se trae en la misma consulta porque quien llama lo usa siempre
+    return OrderPayment.objects.select_related('order').filter(
+        info__icontains=checkout_id,
+        provider='recurrente',
+        order__event=event
+    ).latest('created')
+
+
 def success(request, *args, **kwargs):
     """
     Maneja la redirección del usuario después de un pago exitoso en Recurrente.
@@ -71,11 +88,7 @@ def success(request, *args, **kwargs):
                         logger.info(f"Buscando payment por checkout_id: {checkout_id}")
                         try:
                             # Buscar el pago por checkout_id
-                            payment = OrderPayment.objects.filter(
-                                info__icontains=checkout_id,
-                                provider='recurrente',
-                                order__event=event
-                            ).latest('created')
+                            payment = _find_payment_by_checkout_id(event, checkout_id)
                             order = payment.order
                             logger.info(f"Pedido encontrado a través de payment por checkout_id: {order.code}")
                         except OrderPayment.DoesNotExist:
@@ -91,11 +104,7 @@ def success(request, *args, **kwargs):
             elif checkout_id:
                 try:
                     # Buscar el pago por checkout_id
-                    payment = OrderPayment.objects.filter(
-                        info__icontains=checkout_id,
-                        provider='recurrente',
-                        order__event=event
-                    ).latest('created')
+                    payment = _find_payment_by_checkout_id(event, checkout_id)
                     order = payment.order
                     logger.info(f"Pedido encontrado a través de payment por checkout_id: {order.code}")
                 except OrderPayment.DoesNotExist:
@@ -117,38 +126,21 @@ def success(request, *args, **kwargs):
                 
             # Ahora necesitamos el objeto de pago
             # Prioridad 1: Usar el pago que ya encontramos por checkout_id
-            if payment:
-                # Ya tenemos el payment, comprobado por checkout_id
-                pass
-            # Prioridad 2: Buscar por payment_id si está disponible
-            elif payment_id:
-                try:
-                    payment = order.payments.filter(
-                        provider='recurrente',
-                        info__icontains=payment_id
-                    ).latest('created')
-                except OrderPayment.DoesNotExist:
-                    payment = None
-            
-            # Priority 3: Find payment by checkout_id (from URL) if available
-            if not payment and checkout_id:
-                try:
-                    payment = order.payments.filter(
-                        provider='recurrente',
-                        info__icontains=checkout_id
-                    ).latest('created')
-                except OrderPayment.DoesNotExist:
-                    payment = None
-            
-            # Priority 4: Find the last pending payment for this order and provider
             if not payment:
-                try:
-                    payment = order.payments.filter(
-                        provider='recurrente', 
-                        state=OrderPayment.PAYMENT_STATE_PENDING
-                    ).latest('created')
-                except OrderPayment.DoesNotExist:
-                    payment = None
+                # Un pedido tiene pocos pagos: se cargan una sola vez y las prioridades
+                # restantes se resuelven en memoria en lugar de con una consulta cada una
+                candidates = list(order.payments.filter(provider='recurrente').order_by('-created'))
+                
+                # Prioridad 2: Buscar por payment_id si está disponible
+                # Prioridad 3: Buscar por checkout_id (de la URL) si está disponible
+                for external_id in (payment_id, checkout_id):
+                    if external_id and not payment:
+                        external_id = external_id.lower()
+                        payment = next((p for p in candidates if external_id in (p.info or '').lower()), None)
+                
+                # Prioridad 4: El último pago pendiente del pedido con este proveedor
+                if not payment:
+                    payment = next((p for p in candidates if p.state == OrderPayment.PAYMENT_STATE_PENDING), None)
                     
             # Si llegamos hasta aquí y no tenemos un pago, es un error
             if not payment:
@@ -226,7 +218,6 @@ def success(request, *args, **kwargs):
                             api_path = alt_path.format(checkout_id=checkout_id)
                         
                         # Realizar consulta a la API
-                        from pretix_recurrente.utils import safe_json_parse, safe_confirm_payment
                         logger.info(f"Verificando automáticamente el estado del pago {payment.id} en Recurrente")
                         url = f"{base_url.rstrip('/')}{api_path}"
                         logger.info(f"URL de verificación: {url}")
@@ -400,7 +391,6 @@ def success(request, *args, **kwargs):
                     # Ignorar errores y continuar con el flujo normal
                 
             # Esperar un poco para dar oportunidad al webhook de procesar
-            import time
             time.sleep(2)  # Esperar 2 segundos
             
             # Verificar una última vez si el pago se confirmó durante nuestra espera
@@ -121,7 +121,8 @@ def update_payment_status(request, *args, **kwargs):
             if info.get('checkout_url'):
                 try:
                     receipt_data = scrape_recurrente_receipt(info['checkout_url'])
-                    if receipt_data:
+                    # Solo guardar si el recibo aporta algo distinto de lo ya guardado
+                    if receipt_data and any(info.get(key) != value for key, value in receipt_data.items()):
                         logger.info(f"Datos recuperados del recibo para pago {payment.pk}: {receipt_data}")
                         # Actualizar info_data con los datos extraídos
                         info.update(receipt_data)
@@ -150,20 +151,19 @@ def update_payment_status(request, *args, **kwargs):
                         )
                         
                         if payment_data:
-                            logger.info(f"Datos recuperados de la API para pago {payment.pk}: {payment_data}")
-                            # Actualizar info_data con los datos de la API
-                            if 'receipt_number' in payment_data:
-                                info['receipt_number'] = payment_data['receipt_number']
-                            if 'authorization_code' in payment_data:
-                                info['authorization_code'] = payment_data['authorization_code']
-                            if 'card_network' in payment_data:
-                                info['card_network'] = payment_data['card_network']
-                            if 'card_last4' in payment_data:
-                                info['card_last4'] = payment_data['card_last4']
+                            logger.debug("Datos recuperados de la API para pago %s: %s", payment.pk, payment_data)
+                            # Actualizar info_data con los datos de la API que hayan cambiado
+                            updates = {
+                                key: payment_data[key]
+                                for key in ('receipt_number', 'authorization_code', 'card_network', 'card_last4')
+                                if key in payment_data and info.get(key) != payment_data[key]
+                            }
                             
-                            # Guardar cambios en el objeto payment
-                            payment.info_data = info
-                            payment.save(update_fields=['info'])
+                            # Guardar cambios en el objeto payment (sin escribir si no hay nada nuevo)
+                            if updates:
+                                info.update(updates)
+                                payment.info_data = info
+                                payment.save(update_fields=['info'])
                             messages.success(request, _('Se ha actualizado la información del pago desde la API.'))
                 except Exception as e:
                     logger.warning(f"Error al obtener datos de la API: {str(e)}")
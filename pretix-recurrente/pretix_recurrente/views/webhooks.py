@@ -10,6 +10,7 @@ import json
 import logging
 import traceback
 from datetime import datetime
+from django.core.cache import cache
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
@@ -26,11 +27,210 @@ from django_scopes import scopes_disabled
 from pretix_recurrente.utils import (
     extract_recurrente_data,
     is_webhook_already_processed,
+    json_loads,
     safe_confirm_payment
 )
 
 logger = logging.getLogger('pretix.plugins.recurrente')
 
+# Tiempo (segundos) que se reutiliza la configuración de webhook resuelta para un evento
+_WEBHOOK_CONFIG_CACHE_TIMEOUT = 300
+
+# Claves de configuración de las que depende la configuración de webhook cacheada;
+# al cambiar alguna, signals.py descarta la entrada (ver webhook_config_cache_key)
+WEBHOOK_CONFIG_SETTING_KEYS = frozenset({'recurrente_webhook_secret', 'payment_recurrente_webhook_secret'})
+
+
+def webhook_config_cache_key(organizer_slug, event_slug):
+    """Clave de caché de la configuración de webhook de un evento"""
+    return f'recurrente_webhook_config_{organizer_slug}_{event_slug}'
+
+
+def _get_event_webhook_config(organizer_slug, event_slug):
+    """
+    Obtiene el evento y el secreto de webhook que le corresponde.
+    
+    Usa el secreto del evento o, si no tiene, el del organizador. El resultado
+    se cachea unos minutos porque los webhooks de Recurrente llegan en ráfagas
+    (varios eventos por cada pago) y así se evitan las consultas de organizador,
+    evento y configuración en cada uno; los receptores de signals.py descartan la
+    entrada cuando cambia el secreto o el modo de pruebas. Debe llamarse dentro de
+    scopes_disabled().
+    
+    Args:
+        organizer_slug: Slug del organizador
+        event_slug: Slug del evento
+        
+    Returns:
+        dict: ``event_id``, ``webhook_secret`` (cadena vacía si no hay) y ``testmode``
+        
+    Raises:
+        Organizer.DoesNotExist: Si no existe el organizador
+        Event.DoesNotExist: Si no existe el evento
+    """
+    cache_key = webhook_config_cache_key(organizer_slug, event_slug)
+    config = cache.get(cache_key)
+    if config is not None:
+        return config
+    
+    organizer = Organizer.objects.get(slug=organizer_slug)
+    event = Event.objects.get(slug=event_slug, organizer=organizer)
+    
+    # Obtener la clave secreta del webhook desde la configuración del evento o global
+    webhook_secret = event.settings.get('recurrente_webhook_secret')
+    
+    # Si no hay webhook secret en el evento, buscar en configuración global
+    if not webhook_secret:
+        webhook_secret = organizer.settings.get('recurrente_webhook_secret')
+        if webhook_secret:
+            logger.info(f'Usando webhook secret global del organizador para evento {event_slug}')
+    
+    # La cadena vacía también se cachea, para no repetir la búsqueda en eventos sin secreto
+    config = {
+        'event_id': event.pk,
+        'webhook_secret': webhook_secret or '',
+        'testmode': event.testmode,
+    }
+    cache.set(cache_key, config, _WEBHOOK_CONFIG_CACHE_TIMEOUT)
+    return config
+
+
+def _find_webhook_payment(order, checkout_id, payment_id):
+    """
+    Busca el pago de Recurrente del pedido al que corresponde un webhook.
+    
+    Prioridades: el pago que contiene el checkout_id, el que contiene el
+    payment_id, el último pendiente y, como último recurso, el último pago de
+    Recurrente del pedido. Los pagos del pedido se cargan en una sola consulta y
+    las prioridades se resuelven en memoria.
+    
+    Args:
+        order: Pedido del webhook
+        checkout_id: ID del checkout en Recurrente (puede ser None)
+        payment_id: ID del pago en Recurrente (puede ser None)
+        
+    Returns:
+        OrderPayment: El pago encontrado o None si el pedido no tiene pagos de Recurrente
+    """
+    candidates = list(order.payments.filter(provider='recurrente').order_by('-created'))
+    logger.debug(f'Pagos encontrados para el pedido {order.code}: {[f"{p.pk}:{p.state}" for p in candidates]}')
+    
+    # 1. Primero buscar cualquier pago que coincida con el checkout_id
+    # 2. Si no se encuentra, buscar por payment_id
+    for label, external_id in (('checkout_id', checkout_id), ('payment_id', payment_id)):
+        if not external_id:
+            continue
+        needle = external_id.lower()
+        for payment in candidates:
+            if needle in (payment.info or '').lower():
+                logger.info(f"Pago encontrado por {label}: {external_id} (ID: {payment.pk}, estado: {payment.state})")
+                return payment
+        logger.info(f"No se encontró pago con {label}: {external_id}")
+    
+    # 3. Fallback: buscar el último pago pendiente con este proveedor
+    for payment in candidates:
+        if payment.state == OrderPayment.PAYMENT_STATE_PENDING:
+            logger.info(f"Pago encontrado por estado pendiente (ID: {payment.pk}, sin checkout_id)")
+            return payment
+    
+    # 4. FALLBACK EXTREMO: el último pago de recurrente para este pedido
+    if candidates:
+        payment = candidates[0]
+        logger.warning(f"FALLBACK: Pago encontrado sin filtros específicos (ID: {payment.pk}, estado: {payment.state})")
+        return payment
+    return None
+
+
+def _handle_global_success(order, order_code, event_type, data, checkout_data_obj):
+    """Confirma el pago del pedido ante un webhook global de pago exitoso"""
+    logger.info(f"Procesando pago exitoso para el pedido {order_code} via webhook global.")
+    
+    # Extraer IDs relevantes
+    checkout_id = checkout_data_obj.get('id')
+    payment_id = data.get('payment', {}).get('id', data.get('id'))
+    
+    payment = _find_webhook_payment(order, checkout_id, payment_id)
+    if payment is None:
+        logger.error(f'No se encontró ningún pago de Recurrente para el pedido {order_code}')
+        return HttpResponse(f'No payment found for order {order_code}', status=404)
+    
+    # Si el pago ya está confirmado, devolver éxito sin hacer nada
+    if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
+        logger.info(f'Pago ya confirmado para el pedido {order_code}, ignorando webhook')
+        return HttpResponse('Payment already confirmed', status=200)
+        
+    # Actualizar la información del pago y marcarlo como pagado
+    webhook_info = {
+        'checkout_id': checkout_id,
+        'payment_id': payment_id,
+        'payment_status': 'completed',
+        'webhook_received': True,
+        'webhook_event_type': event_type
+    }
+    info = payment.info_data
+    info.update(webhook_info)
+    
+    # Usar nuestra función segura para confirmar el pago
+    success = safe_confirm_payment(
+        payment=payment,
+        info=info,
+        payment_id=payment_id,
+        logger=logger,
+        extra_info=webhook_info
+    )
+    
+    if success:
+        logger.info(f'Pago confirmado exitosamente para el pedido {order_code}')
+        return HttpResponse('Payment confirmed', status=200)
+    else:
+        logger.warning(f'No se pudo confirmar el pago para el pedido {order_code}')
+        return HttpResponse('Could not confirm payment', status=409)
+
+
+def _handle_global_failed(order, order_code, event_type, data, checkout_data_obj):
+    """Marca como fallido el pago del pedido ante un webhook global de pago fallido o expirado"""
+    logger.info(f"Procesando pago fallido/expirado para el pedido {order_code} via webhook global.")
+    
+    checkout_id = checkout_data_obj.get('id')
+    payment_id = data.get('payment', {}).get('id', data.get('id'))
+    failure_reason = data.get('failure_reason', checkout_data_obj.get('failure_reason', 'Pago no completado'))
+    
+    # Usar la misma lógica de búsqueda mejorada
+    payment = _find_webhook_payment(order, checkout_id, payment_id)
+    if payment is None:
+        logger.error(f'No se encontró ningún pago de Recurrente para el pedido {order_code}')
+        return HttpResponse(f'No payment found for order {order_code}', status=404)
+    
+    # Actualizar la información del pago
+    if payment.state != OrderPayment.PAYMENT_STATE_FAILED:
+        info = payment.info_data
+        info.update({
+            'checkout_id': checkout_id,
+            'payment_id': payment_id,
+            'payment_status': 'failed',
+            'failure_reason': failure_reason,
+            'webhook_received': True,
+            'webhook_event_type': event_type
+        })
+        payment.info_data = info
+        payment.state = OrderPayment.PAYMENT_STATE_FAILED
+        payment.save(update_fields=['state', 'info'])
+        logger.info(f'Pago marcado como fallido para el pedido {order_code}')
+    else:
+        logger.info(f'Pago ya estaba marcado como fallido para el pedido {order_code}')
+    
+    return HttpResponse('Payment marked as failed', status=200)
+
+
+# Manejador de cada tipo de evento que procesa el webhook global
+_GLOBAL_EVENT_HANDLERS = {
+    'payment_intent.succeeded': _handle_global_success,
+    'checkout.completed': _handle_global_success,
+    'payment.failed': _handle_global_failed,
+    'checkout.expired': _handle_global_failed,
+    'payment_intent.payment_failed': _handle_global_failed,
+}
+
 
 @csrf_exempt
 def webhook(request, *args, **kwargs):
@@ -66,9 +266,10 @@ def webhook(request, *args, **kwargs):
         try:
             raw_body = request.body.decode('utf-8')
             logger.debug(f'Raw webhook body: {raw_body}')
-            payload = json.loads(raw_body)
+            # json_loads usa orjson si está disponible y parsea directamente los bytes
+            payload = json_loads(request.body)
             logger.info(f'Webhook recibido de Recurrente: {json.dumps(payload, indent=2)}')
-        except json.JSONDecodeError as e:
+        except (ValueError, UnicodeDecodeError) as e:
             logger.error(f'Payload de webhook inválido: {e}')
             return HttpResponse(f'Invalid webhook payload: {str(e)}', status=400)
         
@@ -85,7 +286,7 @@ def webhook(request, *args, **kwargs):
                     'svix-signature': request.headers.get('svix-signature', '')
                 }
                 wh = Webhook(webhook_secret)
-                payload = wh.verify(request.body.decode('utf-8'), svix_headers)
+                payload = wh.verify(raw_body, svix_headers)
                 logger.info('Verificación de firma de webhook exitosa')
             except WebhookVerificationError as e:
                 logger.error(f'Error de verificación de firma del webhook: {str(e)}')
@@ -198,8 +399,7 @@ def webhook(request, *args, **kwargs):
                 return HttpResponse('Payment already confirmed', status=200)
             
             # Actualizar la información del pago y marcarlo como pagado
-            info = payment.info_data
-            info.update({
+            webhook_info = {
                 'checkout_id': checkout_id,
                 'payment_id': payment_id,
                 'payment_status': 'completed',
@@ -208,21 +408,20 @@ def webhook(request, *args, **kwargs):
                 'estado': 'Recibiendo confirmación',  # Actualizar estado visible
                 'webhook_id': data.get('event_id', ''),
                 'webhook_received_at': datetime.now().isoformat(),
-            })
-            
-            # Guardar toda la carga útil del webhook para depuración
-            info['full_webhook_payload'] = payload
-            
-            payment.info = json.dumps(info)
-            payment.save(update_fields=['info'])
-            logger.info(f'Información de pago actualizada con datos del webhook para pago {payment.pk}')
+                # Guardar toda la carga útil del webhook para depuración
+                'full_webhook_payload': payload,
+            }
+            info = payment.info_data
+            info.update(webhook_info)
             
-            # Usar nuestra función segura para confirmar el pago
+            # safe_confirm_payment guarda webhook_info junto con los datos de la
+            # confirmación en una única escritura
             success = safe_confirm_payment(
                 payment=payment,
                 info=info,
                 payment_id=payment_id,
-                logger=logger
+                logger=logger,
+                extra_info=webhook_info
             )
             
             if success:
@@ -305,9 +504,10 @@ def global_webhook(request, *args, **kwargs):
     try:
         # Obtener el cuerpo del webhook
         try:
-            payload = json.loads(request.body.decode('utf-8'))
+            # json_loads usa orjson si está disponible y parsea directamente los bytes
+            payload = json_loads(request.body)
             logger.info(f'Webhook global recibido de Recurrente: {payload}')
-        except json.JSONDecodeError:
+        except ValueError:
             logger.error('Payload de webhook inválido')
             return HttpResponse('Invalid webhook payload', status=400)
         
@@ -343,22 +543,13 @@ def global_webhook(request, *args, **kwargs):
         # Buscar organizador y evento
         try:
             with scopes_disabled():
-                organizer = Organizer.objects.get(slug=organizer_slug)
-                event = Event.objects.get(slug=event_slug, organizer=organizer)
-                
-                # Obtener la clave secreta del webhook desde la configuración del evento o global
-                webhook_secret = event.settings.get('recurrente_webhook_secret')
-                
-                # Si no hay webhook secret en el evento, buscar en configuración global
-                if not webhook_secret:
-                    webhook_secret = organizer.settings.get('recurrente_webhook_secret')
-                    if webhook_secret:
-                        logger.info(f'Usando webhook secret global del organizador para evento {event_slug}')
+                webhook_config = _get_event_webhook_config(organizer_slug, event_slug)
+                webhook_secret = webhook_config['webhook_secret']
                 
                 # Para webhooks globales, siempre aceptamos webhooks aunque no haya secreto configurado
                 # porque Recurrente solo soporta una URL global
                 if not webhook_secret:
-                    if not event.testmode:
+                    if not webhook_config['testmode']:
                         # Este es el mensaje EXACTO que aparece en los logs
                         logger.error(f'Webhook rechazado: No hay secreto configurado (ni global ni específico) para evento {event_slug} en producción')
                         # A pesar del mensaje de error, continuamos el procesamiento
@@ -384,197 +575,14 @@ def global_webhook(request, *args, **kwargs):
                 # Buscar el pedido y procesarlo dentro del mismo contexto de scopes_disabled
                 try:
                     # Primero intentar encontrar por order_code
-                    order = Order.objects.get(code=order_code, event=event)
+                    order = Order.objects.get(code=order_code, event_id=webhook_config['event_id'])
                     
                     # Procesar según el tipo de evento
-                    if event_type in ('payment_intent.succeeded', 'checkout.completed'):
-                        logger.info(f"Procesando pago exitoso para el pedido {order_code} via webhook global.")
-                        
-                        # Extraer IDs relevantes
-                        checkout_id = checkout_data_obj.get('id')
-                        payment_id = data.get('payment', {}).get('id', data.get('id'))
-                        
-                        # CAMBIO PRINCIPAL: Buscar pago por checkout_id sin filtrar por estado
-                        payment_found = False
-                        
-                        try:
-                            # 1. Primero buscar cualquier pago que coincida con el checkout_id
-                            if checkout_id:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente',
-                                        info__icontains=checkout_id
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.info(f"Pago encontrado por checkout_id: {checkout_id} (estado: {payment.state})")
-                                except OrderPayment.DoesNotExist:
-                                    pass
-                            
-                            # 2. Si no se encuentra, buscar por payment_id
-                            if not payment_found and payment_id:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente',
-                                        info__icontains=payment_id
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.info(f"Pago encontrado por payment_id: {payment_id} (estado: {payment.state})")
-                                except OrderPayment.DoesNotExist:
-                                    pass
-                            
-                            # 3. FALLBACK: buscar pagos pendientes (comportamiento original)
-                            if not payment_found:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente',
-                                        state=OrderPayment.PAYMENT_STATE_PENDING
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.info(f"Pago encontrado por estado pendiente (sin checkout_id)")
-                                except OrderPayment.DoesNotExist:
-                                    pass
-                            
-                            # 4. FALLBACK EXTREMO: Buscar cualquier pago de recurrente para este pedido
-                            if not payment_found:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente'
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.warning(f"FALLBACK: Pago encontrado sin filtros específicos (estado: {payment.state})")
-                                except OrderPayment.DoesNotExist:
-                                    logger.error(f'No se encontró ningún pago de Recurrente para el pedido {order_code}')
-                                    return HttpResponse(f'No payment found for order {order_code}', status=404)
-                            
-                        except OrderPayment.DoesNotExist:
-                            logger.error(f'No se encontró un pago para el pedido {order_code}')
-                            return HttpResponse(f'No payment found for order {order_code}', status=404)
-                        
-                        # Si el pago ya está confirmado, devolver éxito sin hacer nada
-                        if payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
-                            logger.info(f'Pago ya confirmado para el pedido {order_code}, ignorando webhook')
-                            return HttpResponse('Payment already confirmed', status=200)
-                            
-                        # Actualizar la información del pago y marcarlo como pagado
-                        info = payment.info_data
-                        info.update({
-                            'checkout_id': checkout_id,
-                            'payment_id': payment_id,
-                            'payment_status': 'completed',
-                            'webhook_received': True,
-                            'webhook_event_type': event_type
-                        })
-                        
-                        # Usar nuestra función segura para confirmar el pago
-                        success = safe_confirm_payment(
-                            payment=payment,
-                            info=info,
-                            payment_id=payment_id,
-                            logger=logger
-                        )
-                        
-                        if success:
-                            logger.info(f'Pago confirmado exitosamente para el pedido {order_code}')
-                            return HttpResponse('Payment confirmed', status=200)
-                        else:
-                            logger.warning(f'No se pudo confirmar el pago para el pedido {order_code}')
-                            return HttpResponse('Could not confirm payment', status=409)
-                            
-                    elif event_type in ('payment.failed', 'checkout.expired', 'payment_intent.payment_failed'):
-                        logger.info(f"Procesando pago fallido/expirado para el pedido {order_code} via webhook global.")
-                        
-                        checkout_id = checkout_data_obj.get('id')
-                        payment_id = data.get('payment', {}).get('id', data.get('id'))
-                        failure_reason = data.get('failure_reason', checkout_data_obj.get('failure_reason', 'Pago no completado'))
-                        
-                        # Usar la misma lógica de búsqueda mejorada
-                        payment_found = False
-                        
-                        try:
-                            # 1. Primero buscar cualquier pago que coincida con el checkout_id
-                            if checkout_id:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente',
-                                        info__icontains=checkout_id
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.info(f"Pago encontrado por checkout_id: {checkout_id} (estado: {payment.state})")
-                                except OrderPayment.DoesNotExist:
-                                    pass
-                            
-                            # 2. Si no se encuentra, buscar por payment_id
-                            if not payment_found and payment_id:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente',
-                                        info__icontains=payment_id
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.info(f"Pago encontrado por payment_id: {payment_id} (estado: {payment.state})")
-                                except OrderPayment.DoesNotExist:
-                                    pass
-                            
-                            # 3. Fallback: buscar pagos pendientes
-                            if not payment_found:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente',
-                                        state=OrderPayment.PAYMENT_STATE_PENDING
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.info(f"Pago encontrado por estado pendiente (sin checkout_id)")
-                                except OrderPayment.DoesNotExist:
-                                    pass
-                            
-                            # 4. FALLBACK EXTREMO: Buscar cualquier pago de recurrente para este pedido
-                            if not payment_found:
-                                try:
-                                    payment = OrderPayment.objects.filter(
-                                        order=order,
-                                        provider='recurrente'
-                                    ).latest('created')
-                                    payment_found = True
-                                    logger.warning(f"FALLBACK: Pago encontrado sin filtros específicos (estado: {payment.state})")
-                                except OrderPayment.DoesNotExist:
-                                    logger.error(f'No se encontró ningún pago de Recurrente para el pedido {order_code}')
-                                    return HttpResponse(f'No payment found for order {order_code}', status=404)
-                            
-                        except OrderPayment.DoesNotExist:
-                            logger.error(f'No se encontró un pago para el pedido {order_code}')
-                            return HttpResponse(f'No payment found for order {order_code}', status=404)
-                        
-                        # Actualizar la información del pago
-                        if payment.state != OrderPayment.PAYMENT_STATE_FAILED:
-                            info = payment.info_data
-                            info.update({
-                                'checkout_id': checkout_id,
-                                'payment_id': payment_id,
-                                'payment_status': 'failed',
-                                'failure_reason': failure_reason,
-                                'webhook_received': True,
-                                'webhook_event_type': event_type
-                            })
-                            payment.info_data = info
-                            payment.state = OrderPayment.PAYMENT_STATE_FAILED
-                            payment.save(update_fields=['state', 'info'])
-                            logger.info(f'Pago marcado como fallido para el pedido {order_code}')
-                        else:
-                            logger.info(f'Pago ya estaba marcado como fallido para el pedido {order_code}')
-                        
-                        return HttpResponse('Payment marked as failed', status=200)
-                        
-                    # Tipo de evento no manejado
-                    else:
+                    handler = _GLOBAL_EVENT_HANDLERS.get(event_type)
+                    if handler is None:
                         logger.info(f'Tipo de evento no manejado: {event_type}')
                         return HttpResponse(f'Event type {event_type} not handled', status=200)
+                    return handler(order, order_code, event_type, data, checkout_data_obj)
                         
                 except Order.DoesNotExist:
                     logger.error(f'Pedido no encontrado: {order_code}')
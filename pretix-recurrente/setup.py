@@ -32,6 +32,13 @@ setup(
         "requests>=2.25.1",
         "svix>=1.8.0",
     ],
+    extras_require={
+        # Aceleradores opcionales: orjson para JSON y selectolax para el HTML de recibos
+        "speedups": [
+            "orjson>=3.6",
+            "selectolax>=0.3",
+        ],
+    },
     packages=find_packages(),
     include_package_data=True,
     entry_points="""
@@ -0,0 +1,30 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Event, Order, OrderPayment, Organizer
+
+
+@pytest.fixture
+def env():
+    with scopes_disabled():
+        o = Organizer.objects.create(name='Dummy', slug='dummy')
+        event = Event.objects.create(
+            organizer=o, name='Dummy', slug='dummy', plugins='pretix_recurrente',
+            date_from=now(), live=True
+        )
+        order = Order.objects.create(
+            code='FOOBAR', event=event, email='dummy@dummy.test',
+            status=Order.STATUS_PENDING,
+            datetime=now(), expires=now() + timedelta(days=10),
+            total=Decimal('13.37'),
+            sales_channel=o.sales_channels.get(identifier="web"),
+        )
+        payment = order.payments.create(
+            provider='recurrente', state=OrderPayment.PAYMENT_STATE_PENDING,
+            amount=order.total, info='{"checkout_id": "ch_test123"}'
+        )
+    return event, order, payment
@@ -0,0 +1,25 @@
+from pretix_recurrente.payment import _CARD_LAST4_RES, _CARD_NETWORK_RES, _first_group
+
+# Recibo con dos tarjetas. Los datos embebidos (JSON) aparecen antes en la página,
+# pero gana la tarjeta del texto visible porque su patrón tiene más prioridad
+RECEIPT_WITH_TWO_CARDS = """
+<script>var paymentData = {"card": {"network": "visa", "last4": "4242"}};</script>
+<p>Pagado con Mastercard ****5555</p>
+"""
+
+
+def test_card_network_follows_pattern_priority():
+    assert _first_group(_CARD_NETWORK_RES, RECEIPT_WITH_TWO_CARDS) == 'Mastercard'
+
+
+def test_card_last4_follows_pattern_priority():
+    assert _first_group(_CARD_LAST4_RES, RECEIPT_WITH_TWO_CARDS) == '5555'
+
+
+def test_card_last4_falls_back_to_lower_priority_patterns():
+    html = '<span class="card-last4">1111</span> pagado con Visa terminada en 4242'
+    assert _first_group(_CARD_LAST4_RES, html) == '1111'
+
+
+def test_first_group_returns_none_without_match():
+    assert _first_group(_CARD_LAST4_RES, '<p>Sin datos de tarjeta</p>') is None
@@ -0,0 +1,150 @@
+import json
+import weakref
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import OrderPayment
+from pretix.base.signals import periodic_task
+from pretix_recurrente.signals import update_pending_payments
+from pretix_recurrente.utils import update_pending_payments_status
+
+
+def _endpoints():
+    return {'get_checkout': 'https://recurrente.test/api/checkouts/{checkout_id}'}
+
+
+def _checkout_response(status):
+    return mock.Mock(
+        status_code=200,
+        headers={'Content-Type': 'application/json'},
+        content=json.dumps({
+            'id': 'ch_test123',
+            'status': status,
+            'payment': {'id': 'pa_test123'},
+            'total_in_cents': 1337,
+        }).encode(),
+    )
+
+
+@pytest.fixture
+def pending_payment(env):
+    event, order, payment = env
+    with scopes_disabled():
+        # El barrido ignora los pagos de menos de 5 minutos
+        OrderPayment.objects.filter(pk=payment.pk).update(created=now() - timedelta(minutes=10))
+    return payment
+
+
+@pytest.mark.django_db
+def test_sweep_confirms_paid_checkout(env, pending_payment):
+    event = env[0]
+    with mock.patch('pretix_recurrente.utils.get_with_retry', return_value=_checkout_response('paid')) as get:
+        with scopes_disabled():
+            stats = update_pending_payments_status(event, 'pk_test', 'sk_test', _endpoints)
+            pending_payment.refresh_from_db()
+
+    get.assert_called_once()
+    assert get.call_args[0][0] == 'https://recurrente.test/api/checkouts/ch_test123'
+    assert stats == {'total': 1, 'updated': 1, 'errors': 0, 'confirmed': 1}
+    assert pending_payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED
+    info = pending_payment.info_data
+    assert info['status'] == 'paid'
+    assert info['payment_id'] == 'pa_test123'
+    assert info['api_total_in_cents'] == 1337
+    assert info['auto_updated'] is True
+
+
+@pytest.mark.django_db
+def test_sweep_keeps_unpaid_checkout_pending(env, pending_payment):
+    event = env[0]
+    with mock.patch('pretix_recurrente.utils.get_with_retry', return_value=_checkout_response('unpaid')):
+        with scopes_disabled():
+            stats = update_pending_payments_status(event, 'pk_test', 'sk_test', _endpoints)
+            pending_payment.refresh_from_db()
+
+    assert stats == {'total': 1, 'updated': 1, 'errors': 0, 'confirmed': 0}
+    assert pending_payment.state == OrderPayment.PAYMENT_STATE_PENDING
+    assert pending_payment.info_data['status'] == 'unpaid'
+
+
+def _with_concurrent_write(**fields):
+    """
+    safe_json_parse que, antes de devolver la respuesta, escribe en el pago como lo
+    haría un webhook que llega mientras el barrido consulta la API
+    """
+    from pretix_recurrente.utils import safe_json_parse
+
+    def parse(response):
+        OrderPayment.objects.filter(info__contains='ch_test123').update(**fields)
+        return safe_json_parse(response)
+    return parse
+
+
+@pytest.mark.django_db
+def test_sweep_keeps_info_written_during_the_sweep(env, pending_payment):
+    event = env[0]
+    webhook_info = json.dumps({'checkout_id': 'ch_test123', 'webhook_data': {'id': 'pa_test123'}})
+    with mock.patch('pretix_recurrente.utils.get_with_retry', return_value=_checkout_response('unpaid')), \
+            mock.patch('pretix_recurrente.utils.safe_json_parse', _with_concurrent_write(info=webhook_info)):
+        with scopes_disabled():
+            stats = update_pending_payments_status(event, 'pk_test', 'sk_test', _endpoints)
+            pending_payment.refresh_from_db()
+
+    assert stats['updated'] == 1
+    info = pending_payment.info_data
+    assert info['webhook_data'] == {'id': 'pa_test123'}
+    assert info['status'] == 'unpaid'
+
+
+@pytest.mark.django_db
+def test_sweep_skips_payments_confirmed_during_the_sweep(env, pending_payment):
+    event = env[0]
+    webhook_info = json.dumps({'checkout_id': 'ch_test123', 'receipt_number': '12345'})
+    concurrent_write = _with_concurrent_write(info=webhook_info, state=OrderPayment.PAYMENT_STATE_CONFIRMED)
+    with mock.patch('pretix_recurrente.utils.get_with_retry', return_value=_checkout_response('unpaid')), \
+            mock.patch('pretix_recurrente.utils.safe_json_parse', concurrent_write):
+        with scopes_disabled():
+            stats = update_pending_payments_status(event, 'pk_test', 'sk_test', _endpoints)
+            pending_payment.refresh_from_db()
+
+    assert stats == {'total': 1, 'updated': 0, 'errors': 0, 'confirmed': 0}
+    assert pending_payment.info_data == {'checkout_id': 'ch_test123', 'receipt_number': '12345'}
+
+
+@pytest.mark.django_db
+def test_sweep_counts_api_errors(env, pending_payment):
+    event = env[0]
+    response = mock.Mock(status_code=404, headers={}, content=b'')
+    with mock.patch('pretix_recurrente.utils.get_with_retry', return_value=response):
+        with scopes_disabled():
+            stats = update_pending_payments_status(event, 'pk_test', 'sk_test', _endpoints)
+            pending_payment.refresh_from_db()
+
+    assert stats == {'total': 1, 'updated': 0, 'errors': 1, 'confirmed': 0}
+    assert pending_payment.state == OrderPayment.PAYMENT_STATE_PENDING
+
+
+def test_periodic_task_not_connected():
+    connected = [entry[1] for entry in periodic_task.receivers]
+    connected = [ref() if isinstance(ref, weakref.ReferenceType) else ref for ref in connected]
+    assert update_pending_payments not in connected
+
+
+@pytest.mark.django_db
+def test_update_pending_payments_runs_sweep_per_event(env, pending_payment):
+    event = env[0]
+    event.settings.set('payment_recurrente__enabled', True)
+    event.settings.set('payment_recurrente_api_key', 'pk_test')
+    event.settings.set('payment_recurrente_api_secret', 'sk_test')
+
+    stats = {'total': 1, 'updated': 1, 'errors': 0, 'confirmed': 1}
+    with mock.patch('pretix_recurrente.utils.update_pending_payments_status', return_value=stats) as sweep:
+        total_stats = update_pending_payments(sender=None)
+
+    sweep.assert_called_once()
+    assert sweep.call_args[1]['event'] == event
+    assert total_stats == dict(stats, events=1)
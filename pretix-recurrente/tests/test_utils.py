@@ -0,0 +1,43 @@
+from pretix_recurrente.utils import _find_comercio_producto
+
+
+def test_comercio_producto_prefers_specific_subfield():
+    info = {
+        'checkout': {
+            'name': 'Nombre',
+            'business_name': 'Razón social',
+            'description': 'Descripción',
+            'product_description': 'Descripción del producto',
+            'title': 'Título',
+        },
+    }
+    assert _find_comercio_producto(info) == {
+        'comercio_nombre': 'Razón social',
+        'producto_descripcion': 'Descripción del producto',
+        'producto_titulo': 'Título',
+    }
+
+
+def test_comercio_producto_precedence_between_objects():
+    info = {
+        'store': {'name': 'Tienda'},
+        'merchant': {'business_name': 'Comercio'},
+        'seller': {'name': 'Vendedor'},
+        'checkout': {'description': 'Desde checkout', 'title': 'Título checkout'},
+        'product': {'description': 'Desde producto'},
+        'payment': {'product_description': 'Desde pago'},
+    }
+    assert _find_comercio_producto(info) == {
+        'comercio_nombre': 'Vendedor',
+        'producto_descripcion': 'Desde pago',
+        'producto_titulo': 'Título checkout',
+    }
+
+
+def test_comercio_producto_ignores_non_dict_values():
+    info = {
+        'description': 'texto plano',
+        'store': None,
+        'merchant': {'name': 'Comercio'},
+    }
+    assert _find_comercio_producto(info) == {'comercio_nombre': 'Comercio'}
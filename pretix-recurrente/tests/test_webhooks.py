@@ -0,0 +1,45 @@
+import json
+
+import pytest
+from django_scopes import scopes_disabled
+
+from pretix.base.models import OrderPayment
+
+
+def _checkout_completed_payload(order):
+    return {
+        'event_type': 'checkout.completed',
+        'id': 'ch_test123',
+        'metadata': {'order_code': order.code},
+        'amount_in_cents': 1337,
+        'currency': 'GTQ',
+        'customer': {'full_name': 'Dummy', 'email': 'dummy@dummy.test'},
+    }
+
+
+@pytest.mark.django_db
+def test_webhook_checkout_completed_persists_info(env, client):
+    event, order, payment = env
+    payload = _checkout_completed_payload(order)
+
+    response = client.post(
+        '/dummy/dummy/recurrente/webhook/', json.dumps(payload), content_type='application/json'
+    )
+    assert response.status_code == 200
+
+    with scopes_disabled():
+        payment.refresh_from_db()
+    assert payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED
+
+    info = payment.info_data
+    # Datos del webhook
+    assert info['checkout_id'] == 'ch_test123'
+    assert info['payment_status'] == 'completed'
+    assert info['webhook_received'] is True
+    assert info['webhook_event_type'] == 'checkout.completed'
+    assert 'webhook_id' in info
+    assert info['webhook_received_at']
+    assert info['full_webhook_payload'] == payload
+    # Datos de la confirmación
+    assert info['confirmed_by_webhook'] is True
+    assert info['estado'] == 'Confirmado'